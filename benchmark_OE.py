@@ -0,0 +1,240 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+import numpy as np
+import pandas as pd
+import config
+import instrumentation
+from config import CONSTANTS, FULL_FOLDER, NAT_FOLDER, STATE_FOLDER
+
+# (folder the pipeline treats the file as, AREA_TYPE, number of areas)
+SCALES = {
+	'national': (NAT_FOLDER, 1, 1),
+	'state': (STATE_FOLDER, 2, 54),
+	'metro': (FULL_FOLDER, 4, 100),
+}
+# a survey year for each SOC version, so every crosswalk is exercised
+SOC_YEARS = {
+	'soc2000': '2009',
+	'soc2010': '2015',
+	'soc2018': '2019',
+}
+SUPPRESSED_SHARE = 0.03
+TOP_CODED_SHARE = 0.01
+SOC_CODE = re.compile(r'^\d\d-\d\d\d\d$')
+# NAICS values in the forms an all-industries file has them: sectors, sector ranges and 6 digits
+FULL_YEAR_NAICS = ['000000', '11', '21', '22', '23', '31-33', '42', '44-45', '48-49', '51', '52', '53', '54',
+	'55', '56', '61', '62', '71', '72', '81', '99', '541100', '611100', '622100', '999200']
+
+def soc_codes(soc):
+	# detailed codes of each SOC version, plus their major groups as the published files have them
+	if soc == 'soc2018':
+		codes = pd.read_csv('OE/occupation_codes_simple_2018.txt', sep='\t', dtype=str, index_col=False).iloc[:, 0]
+		codes = [code[:2] + '-' + code[2:] for code in codes.dropna()]
+	elif soc == 'soc2010':
+		codes = [t.from_code for t in CONSTANTS.get_transformations_2018()]
+	else:
+		codes = [t.from_code for t in CONSTANTS.get_transformations_2010()]
+	codes = sorted({code for code in codes if isinstance(code, str) and SOC_CODE.match(code)})
+	majors = sorted({code[:2] + '-0000' for code in codes})
+	return sorted(set(codes) | set(majors))
+
+def area_numbers(area_type, count):
+	if area_type == 1:
+		return [99]
+	area_codes = pd.read_csv('OE/area_codes.txt', sep='\t', dtype=str, index_col=False)
+	if area_type == 2:
+		numbers = sorted({int(code) for code in area_codes.state_code if code != '00'})
+	else:
+		numbers = sorted({int(code[2:]) for code, kind in zip(area_codes.area_code, area_codes.area_type_code) if kind == 'M'})
+	return numbers[:count]
+
+def synthetic_frame(scale, soc, seed=0):
+	folder, area_type, count = SCALES[scale]
+	rng = np.random.default_rng(seed)
+	codes = soc_codes(soc)
+	areas = area_numbers(area_type, count)
+	n = len(codes) * len(areas)
+	df = pd.DataFrame({
+		'AREA': np.repeat(areas, len(codes)),
+		'AREA_TITLE': 'Area',
+		'AREA_TYPE': area_type,
+		'NAICS': '000000',
+		'NAICS_TITLE': 'Cross-industry',
+		'OCC_CODE': np.tile(codes, len(areas)),
+		'OCC_TITLE': 'Occupation',
+		'OCC_GROUP': np.where(pd.Series(np.tile(codes, len(areas))).str.endswith('0000'), 'major', 'detailed'),
+	})
+	hourly = rng.uniform(10, 90, n)
+	df['TOT_EMP'] = rng.integers(30, 50000, n).astype(object)
+	df['EMP_PRSE'] = rng.uniform(0.5, 20, n).round(1)
+	for name, pct in [('PCT10', 0.6), ('PCT25', 0.8), ('MEDIAN', 1.0), ('PCT75', 1.25), ('PCT90', 1.5)]:
+		df['H_' + name] = (hourly * pct).round(2)
+		df['A_' + name] = (hourly * pct * 2080).round(0).astype(object)
+	df['H_MEAN'] = (hourly * 1.05).round(2)
+	df['A_MEAN'] = (hourly * 1.05 * 2080).round(0)
+	df['MEAN_PRSE'] = rng.uniform(0.5, 10, n).round(1)
+	# the footnote markers the real files carry
+	df.loc[rng.random(n) < SUPPRESSED_SHARE, 'TOT_EMP'] = '**'
+	df.loc[rng.random(n) < TOP_CODED_SHARE, 'A_PCT90'] = '#'
+	return df
+
+def full_year_frame(areas, seed=0):
+	# a national, a state and a metro block, every occupation in every area, across industries
+	rng = np.random.default_rng(seed)
+	df = pd.concat([synthetic_frame('national', 'soc2018'), synthetic_frame('state', 'soc2018'),
+		synthetic_frame('metro', 'soc2018')], ignore_index=True)
+	df = df.iloc[np.resize(np.arange(len(df)), areas * len(soc_codes('soc2018')))].reset_index(drop=True)
+	df['NAICS'] = rng.choice(FULL_YEAR_NAICS, len(df))
+	return df
+
+def code_generation_timings(ingest, df, repeat=3):
+	# the vectorized area and industry codes against the row-wise functions they replaced
+	naics = df[CONSTANTS.column_heads['other_codes']['industry_code']]
+	runs = {
+		'area_codes': (lambda: df.apply(ingest.get_area_code_enclosure(None, FULL_FOLDER), axis=1),
+			lambda: ingest.get_area_codes(df, FULL_FOLDER)),
+		'industry_codes': (lambda: naics.map(ingest.interpret_industry_code),
+			lambda: ingest.get_industry_codes(naics)),
+	}
+	lines = ['{:<16} {:>10} {:>12} {:>12} {:>8}'.format('codes', 'rows', 'row_wise_s', 'vectorized_s', 'speedup')]
+	for name, (row_wise, vectorized) in runs.items():
+		seconds = []
+		for run in (row_wise, vectorized):
+			timings = []
+			for _ in range(repeat):
+				before = time.perf_counter()
+				run()
+				timings.append(time.perf_counter() - before)
+			seconds.append(min(timings))
+		lines.append('{:<16} {:>10} {:>12.3f} {:>12.4f} {:>7.0f}x'.format(name, len(df), seconds[0], seconds[1], seconds[0] / seconds[1]))
+	return '\n'.join(lines)
+
+def write_inputs(workdir, scale, soc):
+	# a zipped workbook like the BLS downloads; kept between runs since writing xlsx is slow
+	zip_path = os.path.join(workdir, '{}_{}.zip'.format(scale, soc))
+	if not os.path.exists(zip_path):
+		xlsx_path = os.path.join(workdir, '{}_{}_member.xlsx'.format(scale, soc))
+		synthetic_frame(scale, soc).to_excel(xlsx_path, index=False)
+		with zipfile.ZipFile(zip_path + '.tmp', 'w', zipfile.ZIP_DEFLATED) as zipp:
+			zipp.write(xlsx_path, os.path.basename(xlsx_path))
+		os.remove(xlsx_path)
+		os.replace(zip_path + '.tmp', zip_path)
+	return zip_path
+
+def build_database(db_path):
+	if os.path.exists(db_path):
+		os.remove(db_path)
+	subprocess.check_call([sys.executable, 'build_database_OE.py'], stdout=subprocess.DEVNULL,
+						cwd=os.path.dirname(os.path.abspath(__file__)), env=dict(os.environ, OE_DB_PATH=db_path))
+
+def run_pipeline(ingest, zip_path, scale, soc):
+	# the same stages as an ingest run, recorded by instrumentation
+	from download_and_save import process_zip
+	import parse_cache
+	folder = SCALES[scale][0]
+	year = SOC_YEARS[soc]
+	xlsx_path = zip_path.replace('.zip', '.xlsx')
+	with instrumentation.stage('unzip', folder=folder, year=year):
+		process_zip(zip_path)
+	# every file is parsed from scratch, as on a first ingest; a cache hit would time a feather read
+	parse_cache.clear()
+	df = ingest.transform_file(xlsx_path, year, folder)
+	ingest.write_results(df, xlsx_path, year, folder, 'benchmark')
+	os.remove(xlsx_path)
+
+def label_records(records, scale, soc):
+	for record in records:
+		record.update(scale=scale, soc=soc)
+		seconds = record['wall_seconds']
+		record['rows_per_second'] = round(record['rows_in'] / seconds) if record['rows_in'] and seconds > 0 else None
+	return records
+
+def summary(records):
+	lines = ['{:<10} {:<8} {:<14} {:>9} {:>10} {:>12} {:>9}'.format(
+		'scale', 'soc', 'stage', 'seconds', 'rows_in', 'rows/sec', 'peak_mb')]
+	for r in records:
+		lines.append('{:<10} {:<8} {:<14} {:>9.3f} {:>10} {:>12} {:>9}'.format(
+			r['scale'], r['soc'], r['stage'], r['wall_seconds'], r['rows_in'] if r['rows_in'] is not None else '-',
+			r['rows_per_second'] or '-', r.get('peak_traced_mb', '-')))
+	return '\n'.join(lines)
+
+def compare(records, baseline_path):
+	# seconds relative to an earlier results file, > 1 is slower
+	with open(baseline_path) as f:
+		baseline = {(r['scale'], r['soc'], r['stage']): r for r in json.load(f)['results']}
+	lines = ['{:<10} {:<8} {:<14} {:>9} {:>9} {:>7}'.format('scale', 'soc', 'stage', 'before', 'after', 'ratio')]
+	for r in records:
+		old = baseline.get((r['scale'], r['soc'], r['stage']))
+		# results written before the stages were recorded by instrumentation call it seconds
+		before = old and old.get('wall_seconds', old.get('seconds'))
+		if before:
+			lines.append('{:<10} {:<8} {:<14} {:>9.3f} {:>9.3f} {:>7.2f}'.format(
+				r['scale'], r['soc'], r['stage'], before, r['wall_seconds'], r['wall_seconds'] / before))
+	return '\n'.join(lines)
+
+def git_commit():
+	try:
+		return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+									cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Time each ingest stage on synthetic OES workbooks')
+	parser.add_argument('--scales', nargs='+', default=list(SCALES), choices=list(SCALES))
+	parser.add_argument('--socs', nargs='+', default=list(SOC_YEARS), choices=list(SOC_YEARS))
+	parser.add_argument('--metro-areas', type=int, default=SCALES['metro'][2],
+						help='metro areas in the metro scale workbook')
+	parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'oe_benchmark'),
+						help='where the synthetic inputs and the scratch database are kept')
+	parser.add_argument('--output', default='benchmark_results.json')
+	parser.add_argument('--compare', metavar='RESULTS_JSON', help='an earlier output to compare against')
+	parser.add_argument('--code-generation', type=int, metavar='AREAS',
+						help='instead, time area and industry code generation, row-wise and vectorized, on a full-year frame with rows for AREAS areas')
+	parser.add_argument('--no-trace-memory', action='store_true',
+						help='skip tracemalloc, which slows the stages down, and report no peak memory')
+	args = parser.parse_args()
+	SCALES['metro'] = SCALES['metro'][:2] + (args.metro_areas,)
+	os.makedirs(args.workdir, exist_ok=True)
+	db_path = os.path.join(args.workdir, 'benchmark.db')
+	build_database(db_path)
+	# the ingest module connects to DB_PATH when it is imported, and the parse cache is kept away from the real one
+	config.DB_PATH = db_path
+	config.CACHE_FOLDER = os.path.join(args.workdir, 'parse_cache')
+	import get_OE_data_from_xlsx as ingest
+	if args.code_generation:
+		print(code_generation_timings(ingest, full_year_frame(args.code_generation)))
+		sys.exit()
+	instrumentation.configure(echo=False, trace_memory_stages=() if args.no_trace_memory else (instrumentation.ALL_STAGES,))
+	ingest.create_manifest_table()
+	records = []
+	for scale in args.scales:
+		for soc in args.socs:
+			zip_path = write_inputs(args.workdir, scale, soc)
+			run_pipeline(ingest, zip_path, scale, soc)
+			records += label_records(instrumentation.drain(), scale, soc)
+	results = {
+		'commit': git_commit(),
+		'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+		'python': platform.python_version(),
+		'pandas': pd.__version__,
+		'metro_areas': args.metro_areas,
+		'trace_memory': not args.no_trace_memory,
+		'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+		'results': records,
+	}
+	with open(args.output, 'w') as f:
+		json.dump(results, f, indent=1)
+	print(summary(records))
+	if args.compare:
+		print(compare(records, args.compare))
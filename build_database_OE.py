@@ -1,14 +1,60 @@
+import os
 import sqlite3
 import pandas as pd
 import re
 from sqlite3 import IntegrityError
-from config import OE_Constants,DB_PATH
+from config import OE_Constants,DB_PATH,DATA_CODE_AGG_FUNCS,WEIGHT_DATA_CODE
 import sys
+import argparse
+import itertools
 from collections import defaultdict
 
+COMPACT_DIMENSION_TABLES = {
+	'area':'area_key',
+	'industry':'industry_key',
+	'occupation':'occupation_key',
+	'data_type':'data_type_key',
+}
+
+INDEXES = [
+	('series_code_lookup_idx','series_code',['area_code','industry_code','data_type','occupation_code','code']),
+	('value_series_year_idx','value',['series_code','year','value']),
+	('occupation_code_idx','occupation_code',['code','name']),
+]
+
+COMPACT_INDEXES = [
+	('series_lookup_idx','series',['area_id','industry_id','data_type_id','occupation_id','code']),
+	('occupation_code_idx','occupation_code',['code','name']),
+]
+
+# group value per DATA_CODE_AGG_FUNCS function, over member rows of value and weight,
+# falling back like aggregate_measures does; a group without any member value gets none
+ROLLUP_AGG_SQL = {
+	'sum':'SUM(m.value)',
+	'mean':'AVG(m.value)',
+	'wmean':'coalesce(SUM(m.value*m.weight)/SUM(CASE WHEN m.value IS NOT NULL AND m.weight > 0 THEN m.weight END),AVG(m.value))',
+}
+
+# the build is one-off and rerunnable, so trade durability for load speed;
+# reads during the load (series codes, rollups) go through the memory map
+BULK_PRAGMAS = {
+	'journal_mode':'WAL',
+	'synchronous':'OFF',
+	'cache_size':-200000,
+	'temp_store':'MEMORY',
+	'mmap_size':2**30,
+}
+
+# the distributed copy is only read, mostly in index ranges, which larger pages cover in fewer reads
+SNAPSHOT_PAGE_SIZE = 16384
+
 conn = sqlite3.connect(DB_PATH)
 cur = conn.cursor()
 
+def apply_bulk_pragmas(connection=conn,**overrides):
+	for name,value in dict(BULK_PRAGMAS,**overrides).items():
+		connection.execute("""PRAGMA {}={}""".format(name,value))
+
 def create_table_with_df(path,table_name):
 	df = parse_text_file(path)
 	df.to_sql(table_name, conn, if_exists='replace', index=False, dtype={'code':'text','name':'text'})
@@ -38,15 +84,17 @@ def create_area_code_table():
 def insert_into_area_code_table():
 	with open(OE_Constants.AREA_CODE_PATH) as f:
 		next(f)
-		for line in f:
-			insert_one_into_area_code_table(line)
+		with conn:
+			cur.executemany("""INSERT INTO area_code VALUES (?,?,?,?,?);""",
+				(parse_area_code_line(line) for line in f) )
 
-def insert_one_into_area_code_table(line):
+def parse_area_code_line(line):
 	sc,ac,atc,n = line.strip().split('\t')
 	code = atc+ac
-	cur.execute("""INSERT INTO area_code VALUES 
-				("{code}","{sc}","{ac}","{atc}","{n}");
-				""".format(code=code,sc=sc,ac=ac,atc=atc,n=n) )
+	return (code,sc,ac,atc,n)
+
+def insert_one_into_area_code_table(line):
+	cur.execute("""INSERT INTO area_code VALUES (?,?,?,?,?);""", parse_area_code_line(line) )
 
 def create_series_code_table():
 	# drop_table_if_exists('series_code')
@@ -72,52 +120,321 @@ def occupation_codes():
 	codes = [ code for code in codes if code[3:]=='000' ]
 	return codes
 
-def insert_many_areas_into_series_code_table():
+def series_code_rows(area_codes,occupation_codes,industry_codes=OE_Constants.INDUSTRY_CODES,data_types=OE_Constants.DATA_TYPES):
+	# code lists are materialized by the caller, so nothing is re-queried per area
 	prefix = OE_Constants.SERIES_PREFIX
-	for area_code in select_codes(OE_Constants.AREA_CODE_TABLE):
-		for industry_code in OE_Constants.INDUSTRY_CODES:
-			for occupation_code in occupation_codes():
-				for data_type in OE_Constants.DATA_TYPES:
-					code = prefix + area_code + industry_code + occupation_code + data_type
-					insert_one_into_series_code_table(code,occupation_code,industry_code,area_code,data_type)
-	conn.commit()
+	for area_code,industry_code,occupation_code,data_type in itertools.product(
+			area_codes,industry_codes,occupation_codes,data_types):
+		code = prefix + area_code + industry_code + occupation_code + data_type
+		yield (code,occupation_code,industry_code,area_code,data_type,0,0)
+
+def insert_many_into_series_code_table(rows,cursor=cur):
+	with conn:
+		cursor.executemany("""INSERT INTO series_code VALUES (?,?,?,?,?,?,?);""", rows)
+
+def insert_many_areas_into_series_code_table():
+	area_codes = select_codes(OE_Constants.AREA_CODE_TABLE)
+	insert_many_into_series_code_table( series_code_rows(area_codes,occupation_codes()) )
 
 def insert_one_into_series_code_table(code,oc,ic,ac,dt,complete='0',exist='0',cursor=cur):
-	# try:
-		cursor.execute("""INSERT INTO series_code VALUES 
-		('{code}','{oc}','{ic}','{ac}','{dt}',{complete},{exist})
-		;""".format( code=code,oc=oc,ic=ic,ac=ac,dt=dt,
-					complete=complete,exist=exist  ) )
-	# except:
-		# print("non-unique series_code",code)
-		# print( get_name_from_code('occupation_code',oc),
-		# get_name_from_code('area_code',ac),
-		# get_name_from_code('industry_code',ic) )
-
-def create_value_table():
-	cur.execute("""CREATE TABLE IF NOT EXISTS {}
+	cursor.execute("""INSERT INTO series_code VALUES (?,?,?,?,?,?,?);""",
+		(code,oc,ic,ac,dt,int(complete),int(exist)) )
+
+def create_value_table(connection=conn):
+	# value is null for suppressed cells, and flag keeps the footnote marker they had
+	connection.execute("""CREATE TABLE IF NOT EXISTS {}
 					(series_code text not null,
 					year integer not null,
 					period text not null,
 					data_date date not null,
-					value real not null,
+					value real,
+					flag text,
 					primary key(series_code,data_date)
 					foreign key(series_code) REFERENCES series_code(code) )""".format(OE_Constants.VALUE_TABLE))
 
-def insert_all_occupations_into_series_code_table():
-	prefix = OE_Constants.SERIES_PREFIX
-	area_code = OE_Constants.NATIONAL_AREA_CODE
-	for occupation_code in select_codes('occupation_code'):
-		for data_type in OE_Constants.DATA_TYPES:
-			for industry_code in OE_Constants.INDUSTRY_CODES:
-				code = prefix + area_code + industry_code + occupation_code + data_type
-				insert_one_into_series_code_table(code,occupation_code,industry_code,area_code,data_type)
+def create_compact_schema():
+	# integer-keyed series and value tables; the series_code and value views keep
+	# the original names and columns, and their triggers route inserts to the real tables
+	for dimension_table in COMPACT_DIMENSION_TABLES.values():
+		cur.execute("""CREATE TABLE {}
+						(id integer primary key,
+						code text not null unique)""".format(dimension_table))
+	cur.execute("""CREATE TABLE series
+					(id integer primary key,
+					code text not null unique,
+					area_id integer not null REFERENCES area_key(id),
+					industry_id integer not null REFERENCES industry_key(id),
+					occupation_id integer not null REFERENCES occupation_key(id),
+					data_type_id integer not null REFERENCES data_type_key(id),
+					complete boolean not null,
+					exist boolean not null,
+					unique(area_id,industry_id,occupation_id,data_type_id))""")
+	create_series_value_table()
+	cur.execute("""CREATE VIEW series_code AS
+					SELECT s.code AS code,
+					o.code AS occupation_code,
+					i.code AS industry_code,
+					a.code AS area_code,
+					d.code AS data_type,
+					s.complete AS complete,
+					s.exist AS exist
+					FROM series s
+					JOIN area_key a ON a.id = s.area_id
+					JOIN industry_key i ON i.id = s.industry_id
+					JOIN occupation_key o ON o.id = s.occupation_id
+					JOIN data_type_key d ON d.id = s.data_type_id""")
+	cur.execute("""CREATE TRIGGER series_code_insert INSTEAD OF INSERT ON series_code
+					BEGIN
+					{}
+					END""".format(compact_series_insert_sql(
+						'NEW.code','NEW.area_code','NEW.industry_code','NEW.occupation_code','NEW.data_type',
+						'NEW.complete','NEW.exist',or_ignore=False)))
+	create_compact_value_view()
+	conn.commit()
+
+def create_series_value_table(connection=conn):
+	connection.execute("""CREATE TABLE series_value
+					(series_id integer not null REFERENCES series(id),
+					year integer not null,
+					value real,
+					flag text,
+					primary key(series_id,year)) WITHOUT ROWID""")
+
+def create_compact_value_view(connection=conn):
+	connection.execute("""CREATE VIEW {} AS
+					SELECT s.code AS series_code,
+					v.year AS year,
+					'A01' AS period,
+					v.year || '-01-01' AS data_date,
+					v.value AS value,
+					v.flag AS flag
+					FROM series_value v
+					JOIN series s ON s.id = v.series_id""".format(OE_Constants.VALUE_TABLE))
+	# a value for an unseen series creates it, as update_series_code_table would
+	connection.execute("""CREATE TRIGGER value_insert INSTEAD OF INSERT ON {}
+					BEGIN
+					{}
+					INSERT INTO series_value (series_id,year,value,flag)
+					VALUES ((SELECT id FROM series WHERE code = NEW.series_code),NEW.year,NEW.value,NEW.flag)
+					ON CONFLICT(series_id,year) DO UPDATE SET value=excluded.value, flag=excluded.flag;
+					END""".format(OE_Constants.VALUE_TABLE, compact_series_insert_sql(
+						'NEW.series_code','substr(NEW.series_code,4,8)','substr(NEW.series_code,12,6)',
+						'substr(NEW.series_code,18,6)','substr(NEW.series_code,24,2)','1','1',or_ignore=True)))
+
+def rolled_up_data_types():
+	return [code for code,agg_func in sorted(DATA_CODE_AGG_FUNCS.items()) if agg_func is not None]
+
+def measure_agg_sql():
+	# the value of a group of rows m (with data_type, value and weight) by its data type's
+	# function; like aggregate_measures, data types without a function get the mean
+	return 'CASE m.data_type {} ELSE {} END'.format(' '.join(
+		"WHEN '{}' THEN {}".format(code,ROLLUP_AGG_SQL[DATA_CODE_AGG_FUNCS[code]]) for code in rolled_up_data_types()),
+		ROLLUP_AGG_SQL['mean'])
+
+def create_rollup_table(connection=conn):
+	# one row per area, industry, data type, occupation group and year, so a group
+	# dashboard is a range of the primary key
+	connection.execute("""CREATE TABLE IF NOT EXISTS {}
+					(area_code text not null,
+					industry_code text not null,
+					data_type text not null,
+					group_type text not null,
+					group_code text not null,
+					year integer not null,
+					value real,
+					members integer not null,
+					primary key(area_code,industry_code,data_type,group_type,group_code,year)) WITHOUT ROWID""".format(OE_Constants.ROLLUP_TABLE))
+
+def rollup_sql(num_years=None,source_table=None):
+	# Detailed occupations (not ending in 0) roll up into their SOC major and minor groups,
+	# as in sum_groups_df, and any occupation in occ_group into its named group.
+	# Every member row is paired with the weight row of its series and joined to the group
+	# types, so value is read once for all of them.
+	# With a source_table (series_code and value of one year, such as the series of one ingested
+	# file) its rows are the members instead of value's and the year is the first parameter;
+	# rollup_slice_delete_sql clears the rows it replaces first.
+	data_types = rolled_up_data_types()
+	if source_table is None:
+		year_filter = 'AND v.year IN ({})'.format(','.join('?'*num_years)) if num_years is not None else ''
+		year,weight_year,insert = 'v.year','AND w.year = v.year','INSERT'
+	else:
+		year_filter,year,weight_year,insert = '','?','','INSERT'
+	return """{insert} INTO {rollup_table}
+			(area_code,industry_code,data_type,group_type,group_code,year,value,members)
+			WITH member AS (
+				SELECT substr(v.series_code,4,8) AS area_code,
+				substr(v.series_code,12,6) AS industry_code,
+				substr(v.series_code,18,6) AS occupation_code,
+				substr(v.series_code,24,2) AS data_type,
+				{year} AS year,
+				v.value AS value,
+				w.value AS weight
+				FROM {source_table} v
+				LEFT JOIN {source_table} w
+				ON w.series_code = substr(v.series_code,1,23) || '{weight}'
+				{weight_year}
+				WHERE substr(v.series_code,24,2) IN ({data_types})
+				{year_filter}),
+			grouped AS (
+				SELECT m.*,t.group_type,
+				CASE t.group_type
+					WHEN 'major' THEN CASE WHEN m.occupation_code NOT LIKE '%0'
+						THEN substr(m.occupation_code,1,2) || '0000' END
+					WHEN 'minor' THEN CASE WHEN m.occupation_code NOT LIKE '%0' AND substr(m.occupation_code,3,1) != '0'
+						THEN substr(m.occupation_code,1,3) || '000' END
+					ELSE g.group_name END AS group_code
+				FROM member m
+				CROSS JOIN (SELECT 'major' AS group_type UNION ALL SELECT 'minor' UNION ALL SELECT 'occ_group') t
+				LEFT JOIN occ_group g
+				ON t.group_type = 'occ_group' AND g.code = m.occupation_code)
+			SELECT m.area_code,m.industry_code,m.data_type,m.group_type,m.group_code,m.year,{agg},count(m.value)
+			FROM grouped m
+			WHERE m.group_code IS NOT NULL
+			GROUP BY m.area_code,m.industry_code,m.data_type,m.group_type,m.group_code,m.year""".format(
+				insert=insert,rollup_table=OE_Constants.ROLLUP_TABLE,source_table=source_table or OE_Constants.VALUE_TABLE,
+				weight=WEIGHT_DATA_CODE,year=year,weight_year=weight_year,
+				data_types=','.join("'{}'".format(code) for code in data_types),year_filter=year_filter,agg=measure_agg_sql())
+
+def rollup_slice_delete_sql(source_table=None):
+	# the group rows of a year for the areas, industries and data types of one file, so that
+	# groups the file no longer has go too. Without a source_table they are given as parameters.
+	sql = """DELETE FROM {} WHERE year = ? AND """.format(OE_Constants.ROLLUP_TABLE)
+	if source_table is None:
+		return sql + """area_code = ? AND industry_code = ? AND data_type = ?"""
+	return sql + """(area_code,industry_code,data_type) IN (
+			SELECT DISTINCT substr(series_code,4,8),substr(series_code,12,6),substr(series_code,24,2)
+			FROM {} WHERE substr(series_code,24,2) IN ({}))""".format(
+				source_table,','.join("'{}'".format(code) for code in rolled_up_data_types()))
+
+def upsert_rollups(source_table,year,connection=conn):
+	# the group rows of the series in source_table replace those of its slice, in the caller's transaction
+	create_rollup_table(connection)
+	connection.execute(rollup_slice_delete_sql(source_table),(int(year),))
+	return connection.execute(rollup_sql(source_table=source_table),(int(year),)).rowcount
+
+def refresh_rollups(years=None,connection=conn):
+	# recomputes the group rows of the given years, or of every year when None, from value
+	create_rollup_table(connection)
+	years = sorted({int(year) for year in years}) if years is not None else None
+	if years == []:
+		return 0
+	with connection:
+		if years is None:
+			connection.execute("""DELETE FROM {}""".format(OE_Constants.ROLLUP_TABLE))
+		else:
+			connection.execute("""DELETE FROM {} WHERE year IN ({})""".format(
+				OE_Constants.ROLLUP_TABLE,','.join('?'*len(years))),years)
+		cur = connection.execute(rollup_sql(len(years) if years is not None else None),years or [])
+	return cur.rowcount
+
+def migrate_value_flags(connection=conn):
+	# databases built before the flag column have a not null value, which only a rebuild of the table lifts
+	columns = [row[1] for row in connection.execute("""PRAGMA table_info({})""".format(OE_Constants.VALUE_TABLE))]
+	if 'flag' in columns:
+		return
+	compact = is_compact_schema(connection)
+	connection.commit()
+	with connection:
+		# explicit, since the sqlite3 module only opens transactions for DML
+		connection.execute("BEGIN")
+		if compact:
+			connection.execute("""DROP VIEW {}""".format(OE_Constants.VALUE_TABLE))
+			connection.execute("""ALTER TABLE series_value RENAME TO series_value_old""")
+			create_series_value_table(connection)
+			connection.execute("""INSERT INTO series_value (series_id,year,value)
+					SELECT series_id,year,value FROM series_value_old""")
+			connection.execute("""DROP TABLE series_value_old""")
+			create_compact_value_view(connection)
+		else:
+			connection.execute("""ALTER TABLE {0} RENAME TO {0}_old""".format(OE_Constants.VALUE_TABLE))
+			create_value_table(connection)
+			connection.execute("""INSERT INTO {0} (series_code,year,period,data_date,value)
+					SELECT series_code,year,period,data_date,value FROM {0}_old""".format(OE_Constants.VALUE_TABLE))
+			connection.execute("""DROP TABLE {}_old""".format(OE_Constants.VALUE_TABLE))
+	create_indexes(connection)
+
+def compact_series_insert_sql(code,area_code,industry_code,occupation_code,data_type,complete,exist,or_ignore):
+	components = {
+		'area':area_code,
+		'industry':industry_code,
+		'occupation':occupation_code,
+		'data_type':data_type,
+	}
+	statements = [
+		"INSERT OR IGNORE INTO {table} (code) VALUES ({value});".format(
+			table=COMPACT_DIMENSION_TABLES[name],value=value)
+		for name,value in components.items()
+	]
+	ids = ','.join(
+		"(SELECT id FROM {table} WHERE code = {value})".format(
+			table=COMPACT_DIMENSION_TABLES[name],value=value)
+		for name,value in components.items()
+	)
+	statements.append("""INSERT {or_ignore}INTO series
+		(code,area_id,industry_id,occupation_id,data_type_id,complete,exist)
+		VALUES ({code},{ids},{complete},{exist});""".format(
+			or_ignore='OR IGNORE ' if or_ignore else '',
+			code=code,ids=ids,complete=complete,exist=exist))
+	return '\n'.join(statements)
+
+def add_soc_level_column():
+	# SOC hierarchy level from the trailing zeros, matching the rollup in sum_groups_df
+	cur.execute("""ALTER TABLE {} ADD COLUMN soc_level integer""".format(OE_Constants.OCCUPATION_CODE_TABLE))
+	cur.execute("""UPDATE {} SET soc_level = CASE
+					WHEN code = '000000' THEN {total}
+					WHEN code LIKE '__0000' THEN {major}
+					WHEN code LIKE '____00' THEN {minor}
+					WHEN code LIKE '_____0' THEN {broad}
+					ELSE {detailed} END""".format(OE_Constants.OCCUPATION_CODE_TABLE,**OE_Constants.SOC_LEVELS))
 	conn.commit()
 
+def is_compact_schema(connection=conn):
+	ret = connection.execute("""SELECT count(*) FROM sqlite_master
+			WHERE type='table' AND name='series';""").fetchall()
+	return ret[0][0] > 0
+
+def secondary_indexes(connection=conn):
+	if is_compact_schema(connection):
+		return COMPACT_INDEXES
+	return INDEXES
+
+def create_indexes(connection=conn):
+	# covering indexes for the lookups in sql_queries.sql and examples.ipynb:
+	# filter series codes by area/industry/data type/occupation, then join values on the code
+	for name,table,columns in secondary_indexes(connection):
+		connection.execute("""CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns});""".format(
+			name=name,table=table,columns=','.join(columns)))
+	connection.commit()
+
+def drop_indexes(connection=conn):
+	# a bulk load into tables without them, followed by create_indexes, sorts each index once
+	# instead of updating it row by row; primary keys stay, the load relies on them
+	for name,_,_ in secondary_indexes(connection):
+		connection.execute("""DROP INDEX IF EXISTS {};""".format(name))
+	connection.commit()
+
+def analyze(connection=conn):
+	connection.execute("""ANALYZE;""")
+	connection.commit()
+
+def write_snapshot(path,page_size=SNAPSHOT_PAGE_SIZE,connection=conn):
+	# a vacuumed copy for readers: no free pages, every table and index stored in order, the
+	# statistics of the last ANALYZE, and a rollback journal, so it can be opened immutable.
+	# The page size only applies to the copy.
+	if os.path.exists(path):
+		os.remove(path)
+	connection.commit()
+	connection.execute("""PRAGMA page_size={}""".format(int(page_size)))
+	connection.execute("""VACUUM INTO ?""",(path,))
+	return os.path.getsize(path)
+
+def insert_all_occupations_into_series_code_table():
+	area_codes = [OE_Constants.NATIONAL_AREA_CODE]
+	insert_many_into_series_code_table( series_code_rows(area_codes,select_codes('occupation_code')) )
+
 def get_name_from_code(table_name,code):
 	ret = cur.execute("""SELECT name from {table_name}
-			WHERE code='{code}';""".format(
-				table_name=table_name, code = code) ).fetchall()
+			WHERE code=?;""".format(table_name=table_name), (code,) ).fetchall()
 	return ret[0][0]
 
 def new_occ_group_table():
@@ -138,35 +455,29 @@ def load_occ_grps():
 		ret[ row['group_name'] ].append( str( row['occ_code'] ) )
 	return ret
 
-def create_occ_group_table():
+def create_occ_group_table(grps=None):
+	grps = grps if grps is not None else load_occ_grps()
 	new_occ_group_table()
-	for grp in grps:
-		for code in grps[grp]:
-			code = rem_hyphen(code)
-			insert_one_into_occ_group_table(code,grp)
-	conn.commit()
+	rows = ( (rem_hyphen(code),grp) for grp in grps for code in grps[grp] )
+	with conn:
+		cur.executemany("""INSERT into occ_group VALUES (?,?)""", rows)
 
 def insert_one_into_occ_group_table(code,group_name):
-	# name = get_name_from_code('occupation_code',code)
 	try:
-		cur.execute("""INSERT into occ_group VALUES
-	( '{code}'  , '{group_name}' )""".format(
-		code=code,#name=name.replace("'","''"),
-		group_name=group_name.replace("'","''")) )
-	except:
-		print(code,'|',name,'|',group_name)
+		cur.execute("""INSERT into occ_group VALUES (?,?)""", (code,group_name) )
+	except IntegrityError:
+		print(code,'|',group_name)
 
 def insert_all_areas_occupations_into_series_code_table():
-	prefix = OE_Constants.SERIES_PREFIX
-	for area_code in select_codes(OE_Constants.AREA_CODE_TABLE):
-		for industry_code in OE_Constants.INDUSTRY_CODES:
-			for occupation_code in select_codes('occ_group'):
-				for data_type in OE_Constants.DATA_TYPES:
-					code = prefix + area_code + industry_code + occupation_code + data_type
-					insert_one_into_series_code_table(code,occupation_code,industry_code,area_code,data_type)
-	conn.commit()
+	area_codes = select_codes(OE_Constants.AREA_CODE_TABLE)
+	insert_many_into_series_code_table( series_code_rows(area_codes,select_codes('occ_group')) )
 
 if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Create the OE database and its code tables')
+	parser.add_argument('--compact', action='store_true',
+						help='store series and values in integer-keyed tables behind views')
+	args = parser.parse_args()
+	apply_bulk_pragmas()
 	grps = load_occ_grps()
 	create_table_with_df(OE_Constants.OCCUPATION_CODE_PATH,OE_Constants.OCCUPATION_CODE_TABLE)
 	create_table_with_df(OE_Constants.INDUSTRY_CODE_PATH,OE_Constants.INDUSTRY_CODE_TABLE)
@@ -174,11 +485,18 @@ if __name__ == '__main__':
 	create_table_with_df(OE_Constants.DATA_TYPE_PATH,OE_Constants.DATA_TYPE_TABLE)
 	create_table_with_df(OE_Constants.STATE_ABBREV_PATH,OE_Constants.STATE_ABBREV_TABLE)
 
+	add_soc_level_column()
+
 	create_area_code_table()
-	create_series_code_table()
+	if args.compact:
+		create_compact_schema()
+	else:
+		create_series_code_table()
+		create_value_table()
 	insert_all_occupations_into_series_code_table()
-	create_value_table()
-	create_occ_group_table()
+	create_occ_group_table(grps)
+	create_rollup_table()
+	create_indexes()
 
 	conn.commit()
 
@@ -0,0 +1,125 @@
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from config import OE_Constants, DB_PATH
+
+# the lookups from sql_queries.sql and examples.ipynb, with their literals as parameters
+CANONICAL_QUERIES = {
+	'metro_major_groups': ("""SELECT o.name,v.year,v.value FROM value v
+		join series_code sc
+		on v.series_code = sc.code
+		join occupation_code o
+		on o.code = sc.occupation_code
+		where sc.area_code=?
+		and sc.industry_code=?
+		and sc.occupation_code like '__0000'
+		order by 1 asc, 2 asc;""", ('M0048140','000000')),
+	'area_occupation_series': ("""SELECT v.year,v.value
+		FROM value v
+		JOIN series_code sc
+		ON sc.code = v.series_code
+		WHERE sc.area_code = ?
+		AND sc.occupation_code = ?
+		AND sc.industry_code = ?
+		AND sc.data_type = ?
+		ORDER BY 1 ASC;""", ('M0026420','172141','000000','01')),
+	'national_occupation_total': ("""SELECT v.year,SUM(v.value)
+		FROM value v
+		JOIN series_code sc
+		ON sc.code = v.series_code
+		WHERE sc.area_code = ?
+		AND sc.occupation_code IN ('151131','151132','151133','151134')
+		AND sc.industry_code = ?
+		AND sc.data_type = ?
+		GROUP BY 1
+		ORDER BY 1 ASC;""", ('N0000000','000000','01')),
+}
+
+def explain(conn, sql, params):
+	return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+# the compact schema's industry_key and data_type_key hold a handful of rows,
+# so the planner rightly prefers scanning them to an index search
+SMALL_TABLE_SCANS = {'SCAN i', 'SCAN d', 'SCAN CONSTANT ROW'}
+
+def full_scans(plan):
+	# SCAN without USING ... INDEX reads a whole table, and an AUTOMATIC index
+	# is built from a whole table on every run; SEARCH on a real index is fine
+	return [step for step in plan
+			if (step.startswith('SCAN ') and 'INDEX' not in step and step not in SMALL_TABLE_SCANS)
+			or 'AUTOMATIC' in step]
+
+def time_query(conn, sql, params, repeat):
+	timings = []
+	for _ in range(repeat):
+		before = time.perf_counter()
+		conn.execute(sql, params).fetchall()
+		timings.append(time.perf_counter() - before)
+	return timings
+
+def check_queries(conn, repeat=5):
+	failures = []
+	for name, (sql, params) in CANONICAL_QUERIES.items():
+		plan = explain(conn, sql, params)
+		scans = full_scans(plan)
+		timings = time_query(conn, sql, params, repeat)
+		print('{:<28} median {:8.2f} ms  min {:8.2f} ms  {}'.format(
+			name, statistics.median(timings)*1000, min(timings)*1000, 'FULL SCAN' if scans else 'ok'))
+		for step in plan:
+			print('    ', step)
+		if scans:
+			failures.append((name, scans))
+	return failures
+
+def build_synthetic_db(path, years, compact=False):
+	# builds the code tables with build_database_OE.py, then one value per
+	# area x occupation x data type x year, i.e. a fully populated database
+	if os.path.exists(path):
+		os.remove(path)
+	cmd = [sys.executable, 'build_database_OE.py'] + (['--compact'] if compact else [])
+	subprocess.check_call(cmd, cwd=os.path.dirname(os.path.abspath(__file__)),
+						env=dict(os.environ, OE_DB_PATH=os.path.abspath(path)))
+	conn = sqlite3.connect(path)
+	conn.execute('PRAGMA synchronous=OFF')
+	area_codes = [r[0] for r in conn.execute('SELECT code FROM area_code')]
+	occupation_codes = [r[0] for r in conn.execute('SELECT code FROM occupation_code')]
+	industry_code = OE_Constants.ALL_INDUSTRY_CODE
+	combos = list(itertools.product(area_codes, occupation_codes, OE_Constants.DATA_TYPES))
+	prefix = OE_Constants.SERIES_PREFIX
+	with conn:
+		conn.executemany('INSERT OR IGNORE INTO series_code VALUES (?,?,?,?,?,1,1)', (
+			(prefix+area_code+industry_code+occupation_code+data_type,
+				occupation_code,industry_code,area_code,data_type)
+			for area_code,occupation_code,data_type in combos))
+	rng = random.Random(0)
+	with conn:
+		conn.executemany('INSERT INTO value (series_code,year,period,data_date,value) VALUES (?,?,?,?,?)', (
+			(prefix+area_code+industry_code+occupation_code+data_type,
+				year,'A01','{}-01-01'.format(year),rng.random()*1000)
+			for area_code,occupation_code,data_type in combos for year in years))
+	conn.execute('ANALYZE')
+	conn.commit()
+	return conn
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Check the canonical OES queries for full table scans and time them')
+	parser.add_argument('--db', default=DB_PATH, help='database to check')
+	parser.add_argument('--synthetic', action='store_true',
+						help='first build a fully populated synthetic database at --db')
+	parser.add_argument('--compact', action='store_true', help='build the synthetic database with the compact schema')
+	parser.add_argument('--years', type=int, default=5, help='years of values in the synthetic database')
+	parser.add_argument('--repeat', type=int, default=5)
+	args = parser.parse_args()
+	if args.synthetic:
+		conn = build_synthetic_db(args.db, range(2019-args.years+1, 2020), compact=args.compact)
+	else:
+		conn = sqlite3.connect(args.db)
+	failures = check_queries(conn, repeat=args.repeat)
+	if failures:
+		sys.exit('full table scans in: {}'.format(', '.join(name for name,_ in failures)))
@@ -1,16 +1,61 @@
+import os
+import json
+import numpy as np
 import pandas as pd
+from functools import lru_cache
 from typing import NamedTuple, Callable, List
 import operator
 
-DB_PATH = 'OE.db'
+DB_PATH = os.environ.get('OE_DB_PATH', 'OE.db')
 
 DATA_FOLDER = 'data'
 FULL_FOLDER = 'full'
 NAT_FOLDER = 'nat'
 STATE_FOLDER = 'state'
 METRO_FOLDER = 'metro'
-FINAL_OCCS = pd.read_csv("OE/occupation_codes_simple_2018.txt", sep="\t")
-DATA_CODE_AGG_FUNCS = {'01':'sum','13':'mean'}
+DOWNLOAD_WORKERS = 4
+DOWNLOAD_MIN_INTERVAL = 1.0
+CACHE_FOLDER = os.path.join(DATA_FOLDER, 'cache')
+PARSE_CACHE_MAX_BYTES = 4 * 1024**3
+# rows per frame when a file is ingested in chunks instead of whole
+STREAM_CHUNK_ROWS = 20000
+# how SOC group values are built from their detailed occupations: employment is summed,
+# wages are employment-weighted means ('wmean'), and None keeps the published group
+# values, for the relative standard errors which do not aggregate
+DATA_CODE_AGG_FUNCS = {
+	'01':'sum',
+	'02':None,
+	'03':'wmean',
+	'04':'wmean',
+	'05':None,
+	'06':'wmean',
+	'07':'wmean',
+	'08':'wmean',
+	'09':'wmean',
+	'10':'wmean',
+	'11':'wmean',
+	'12':'wmean',
+	'13':'wmean',
+	'14':'wmean',
+	'15':'wmean',
+}
+# the data type whose values weigh the 'wmean' measures
+WEIGHT_DATA_CODE = '01'
+# BLS footnote markers found in place of a value: '*' and '**' for estimates that are
+# not available or not released, '#' for wages at or above the top-coding limit
+VALUE_FLAGS = ['*', '**', '#']
+# trailing zeros of the broad, minor and major SOC group codes
+SOC_GROUP_LEVELS = (1,2,3,4)
+
+@lru_cache(maxsize=None)
+def get_final_occs():
+	return pd.read_csv("OE/occupation_codes_simple_2018.txt", sep="\t")
+
+def __getattr__(name):
+	# FINAL_OCCS is read on first access instead of at import
+	if name == 'FINAL_OCCS':
+		return get_final_occs()
+	raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
 class Transformation(NamedTuple):
 	from_code: str
@@ -21,6 +66,29 @@ class TransformationGroup(NamedTuple):
 	operation: Callable
 	transformations: List[Transformation]
 
+def crosswalk_code(code):
+	# some codes in the spreadsheets carry trailing spaces, e.g. '13-1161  '
+	return code.strip() if isinstance(code, str) else code
+
+def load_crosswalk(path, skiprows, from_col, to_col):
+	# the parsed pairs are kept in a JSON file next to the spreadsheet,
+	# reused while the spreadsheet's size and mtime are unchanged
+	cache_path = os.path.splitext(path)[0] + '.json'
+	stat = os.stat(path)
+	source = [stat.st_size, stat.st_mtime_ns]
+	try:
+		with open(cache_path) as f:
+			cached = json.load(f)
+		if cached['source'] == source:
+			return [Transformation(*map(crosswalk_code, pair)) for pair in cached['transformations']]
+	except (IOError, ValueError, KeyError):
+		pass
+	crosswalk_df = pd.read_excel(path, skiprows=skiprows)
+	pairs = list(zip(crosswalk_df[from_col].tolist(), crosswalk_df[to_col].tolist()))
+	with open(cache_path, 'w') as f:
+		json.dump({'source': source, 'transformations': pairs}, f)
+	return [Transformation(*map(crosswalk_code, pair)) for pair in pairs]
+
 class Constants:
 	STATE_CODES_PATH = 'SM/state_codes.txt'
 	STATE_CODE_TABLE = 'state_code'
@@ -58,9 +126,14 @@ class OE_Constants:
 	SERIES_PREFIX = 'OEU'
 	DATA_TYPES = ['13','01']
 	VALUE_TABLE = 'value'
+	MANIFEST_TABLE = 'ingest_manifest'
+	ROLLUP_TABLE = 'occ_rollup'
+	# occupation groups materialized in ROLLUP_TABLE; occ_group stands for the named groups of the occ_group table
+	ROLLUP_GROUP_TYPES = ['major', 'minor', 'occ_group']
 	INDUSTRY_CODES = ['000000']
 	NATIONAL_AREA_CODE = 'N0000000'
 	ALL_INDUSTRY_CODE = '000000'
+	SOC_LEVELS = {'total':0, 'major':1, 'minor':2, 'broad':3, 'detailed':4}
 
 
 class XLS_Constants(object):
@@ -99,38 +172,48 @@ class XLS_Constants(object):
 			'1998':38,
 			'1997':38,
 		}
-		self.add_transformations()
+		self._transformation_groups = None
+		self._degrouping_transformation_groups = None
+
+	# the crosswalk spreadsheets are only parsed when a transformation group is first needed
+	@property
+	def transformation_groups(self):
+		if self._transformation_groups is None:
+			self.add_transformations()
+		return self._transformation_groups
+
+	@property
+	def degrouping_transformation_groups(self):
+		if self._degrouping_transformation_groups is None:
+			self.add_transformations()
+		return self._degrouping_transformation_groups
 
 	def add_transformations(self):
-		self.transformation_groups = []
-		self.degrouping_transformation_groups = []
+		self._transformation_groups = []
+		self._degrouping_transformation_groups = []
 		# 2010 transformations
 		transformations_2010 = self.get_transformations_2010()
 		transformation_group = TransformationGroup(transformations=transformations_2010, year=2010, operation=operator.le)
-		self.transformation_groups.append(transformation_group)
+		self._transformation_groups.append(transformation_group)
 		# 2018 transformations
 		transformations_2018 = self.get_transformations_2018()
 		transformation_group = TransformationGroup(transformations=transformations_2018, year=2018, operation=operator.le)
-		self.transformation_groups.append(transformation_group)
+		self._transformation_groups.append(transformation_group)
 		# 2010 transformation degrouping
 		group_2010_transformations = self.get_group_2010_transformations()
-		self.degrouping_transformation_groups.append(TransformationGroup(transformations=group_2010_transformations, year=2010, operation=operator.eq))
-		self.degrouping_transformation_groups.append(TransformationGroup(transformations=group_2010_transformations, year=2011, operation=operator.eq))
+		self._degrouping_transformation_groups.append(TransformationGroup(transformations=group_2010_transformations, year=2010, operation=operator.eq))
+		self._degrouping_transformation_groups.append(TransformationGroup(transformations=group_2010_transformations, year=2011, operation=operator.eq))
 		# 2018 transformations
 		transformations_2018 = self.get_group_transformations_2018()
-		self.degrouping_transformation_groups.append(TransformationGroup(transformations=transformations_2018, year=2019, operation=operator.eq))
-		self.degrouping_transformation_groups.append(TransformationGroup(transformations=transformations_2018, year=2018, operation=operator.eq))
-		self.degrouping_transformation_groups.append(TransformationGroup(transformations=transformations_2018, year=2017, operation=operator.eq))
+		self._degrouping_transformation_groups.append(TransformationGroup(transformations=transformations_2018, year=2019, operation=operator.eq))
+		self._degrouping_transformation_groups.append(TransformationGroup(transformations=transformations_2018, year=2018, operation=operator.eq))
+		self._degrouping_transformation_groups.append(TransformationGroup(transformations=transformations_2018, year=2017, operation=operator.eq))
 		# 2019 transformations
 		transformations_2019 = self.get_group_transformations_2019()
-		self.degrouping_transformation_groups.append(TransformationGroup(transformations=transformations_2019, year=2019, operation=operator.eq))
+		self._degrouping_transformation_groups.append(TransformationGroup(transformations=transformations_2019, year=2019, operation=operator.eq))
 
 	def get_transformations_2010(self):
-		crosswalk_2010_df = pd.read_excel('soc_2000_to_2010_crosswalk.xls',skiprows=6)
-		transformations = [
-			Transformation(from_code=row["2000 SOC code"], to_code=row["2010 SOC code"])
-			for _,row in crosswalk_2010_df.iterrows()
-		]
+		transformations = load_crosswalk('soc_2000_to_2010_crosswalk.xls', 6, "2000 SOC code", "2010 SOC code")
 		##
 		transformations.append(Transformation(from_code='29-1111', to_code='29-1141'))
 		transformations.append(Transformation(from_code='13-1079', to_code='13-1071'))
@@ -171,11 +254,7 @@ class XLS_Constants(object):
 	# def get_reverse_transformations_2018
 
 	def get_transformations_2018(self):
-		crosswalk_df = pd.read_excel('soc_2010_to_2018_crosswalk.xlsx',skiprows=8)
-		transformations = [
-			Transformation(from_code=row["2010 SOC Code"], to_code=row["2018 SOC Code"])
-			for _,row in crosswalk_df.iterrows()
-		]
+		transformations = load_crosswalk('soc_2010_to_2018_crosswalk.xlsx', 8, "2010 SOC Code", "2018 SOC Code")
 		transformations.append(Transformation(from_code='29-1069', to_code='29-1229'))
 		transformations.append(Transformation(from_code='15-1199', to_code='15-1299'))
 		transformations.append(Transformation(from_code='11-9199', to_code='11-9199'))
@@ -224,59 +303,141 @@ class XLS_Constants(object):
 
 CONSTANTS = XLS_Constants()
 
+def categorical_map(values, func):
+	# func runs once per distinct value, and the result is a categorical of what it returns
+	codes, uniques = pd.factorize(values)
+	return categorical_take(codes, [func(value) for value in uniques])
+
+def categorical_take(codes, values):
+	# the categorical of values[codes], with code -1 for missing; equal values share a category
+	value_codes, categories = pd.factorize(pd.Series(values, dtype=object))
+	return pd.Categorical.from_codes(np.append(value_codes, -1)[codes], categories)
+
+def aggregate_measures(df, by):
+	# one groupby for every measure in a long frame of VALUE and WEIGHT;
+	# the DATA_TYPE key of each group picks its function from DATA_CODE_AGG_FUNCS,
+	# and a group without any value gets none
+	valid = df["VALUE"].notna()
+	weight = df["WEIGHT"].where(valid, 0).fillna(0)
+	parts = pd.DataFrame({
+		"value": df["VALUE"],
+		"weighted": df["VALUE"].fillna(0) * weight,
+		"weight": weight,
+		"count": valid.astype(np.int64),
+	})
+	for key in by:
+		# categorical keys stay categorical, and are grouped by their codes
+		parts[key] = df[key].array
+	sums = parts.groupby(by, sort=False, observed=True).sum()
+	funcs = sums.index.get_level_values("DATA_TYPE").astype(object).map(DATA_CODE_AGG_FUNCS)
+	total = sums["value"].where(sums["count"] > 0)
+	mean = total / sums["count"]
+	wmean = (sums["weighted"] / sums["weight"].where(sums["weight"] > 0)).fillna(mean)
+	values = np.select([funcs == "sum", funcs == "wmean"], [total, wmean], default=mean)
+	return pd.Series(values, index=sums.index)
+
 def sum_groups_df(df):
 	# Aggregate by group. We calculate group totals from constituents, results in more consistent group totals, as totals change per year.
-	# WE ALSO SUBSET to only the columns with aggregation functions: DATA_CODE_AGG_FUNCS
-	group_values = {}
-	INDEX_COLUMNS = ["SERIES_CODE"]
-	for data_type_code in ["01"]:
-		data_col = CONSTANTS.column_heads["data_codes"][data_type_code]
-		agg_func = DATA_CODE_AGG_FUNCS[data_type_code]
-		for num_zeros in (1,2,3,4):
-			df_copy = df.copy()
-			df_copy = df_copy[~df_copy["OCC_CODE"].str.endswith("0")].reset_index(drop=True)
-			# df_copy["OCC_CODE"] = df_copy["OCC_CODE"].str.slice(stop=7-num_zeros) + "0"*num_zeros
-			df_copy["SERIES_CODE"] = (
-				df_copy["SERIES_CODE"].str.slice(stop=25-(2+num_zeros)) + 
-				"0"*num_zeros +
-				df_copy["SERIES_CODE"].str.slice(start=23)
-			)
-			agg_df = df_copy[INDEX_COLUMNS + [data_col]].groupby(INDEX_COLUMNS).agg(agg_func).reset_index()
-			agg_dict = agg_df.set_index(["SERIES_CODE"])[data_col].to_dict()
-			group_values = {**group_values, **agg_dict}
-	df[data_col] = [group_values.get(series_code, value)
-		for series_code, value 
-		in zip(df["SERIES_CODE"], df[data_col])
-	]
+	# Every SOC level (broad, minor, major) of every measure is derived from the detailed codes and aggregated in a single groupby.
+	# df is in long form, one row per series with categorical AREA_CODE, INDUSTRY_CODE, OCCUPATION_CODE and DATA_TYPE,
+	# and its VALUE, WEIGHT and FLAG. Groups none of whose constituents have a value keep their published value and flag.
+	# The SOC hierarchy is worked out on the occupation categories, and rows only carry their integer codes.
+	rolled_up = [code for code, agg_func in DATA_CODE_AGG_FUNCS.items() if agg_func is not None]
+	occ_codes = df["OCCUPATION_CODE"].cat.codes.to_numpy()
+	occ_categories = pd.Series(np.asarray(df["OCCUPATION_CODE"].cat.categories, dtype=object))
+	area_codes = df["AREA_CODE"].cat.codes.to_numpy().astype(np.int64)
+	industry_codes = df["INDUSTRY_CODE"].cat.codes.to_numpy().astype(np.int64)
+	data_types = df["DATA_TYPE"].array
+	# with a trailing False, code -1 (no occupation) looks up as not detailed
+	detailed = np.append(~occ_categories.str.endswith("0").to_numpy(dtype=bool), False)[occ_codes]
+	detailed &= df["DATA_TYPE"].isin(rolled_up).to_numpy()
+	group_ids, group_uniques = pd.factorize(pd.concat(
+		[occ_categories.str.slice(stop=6-num_zeros) + "0"*num_zeros for num_zeros in SOC_GROUP_LEVELS],
+		ignore_index=True))
+	rows, groups = [], []
+	for level, num_zeros in enumerate(SOC_GROUP_LEVELS):
+		keep = np.ones(len(occ_categories), dtype=bool)
+		if num_zeros != SOC_GROUP_LEVELS[-1]:
+			# if the digit zeroed out here is already 0, the next level up gives the same
+			# group code from a superset of rows, and that level's total is the one kept
+			keep = (occ_categories.str.get(5-num_zeros) != "0").to_numpy()
+		level_rows = np.flatnonzero(detailed & np.append(keep, False)[occ_codes])
+		rows.append(level_rows)
+		groups.append(group_ids[level*len(occ_categories) + occ_codes[level_rows]])
+	rows = np.concatenate(rows)
+	group_df = pd.DataFrame({
+		"area": area_codes[rows],
+		"industry": industry_codes[rows],
+		"group": np.concatenate(groups),
+		"DATA_TYPE": data_types.take(rows),
+		"VALUE": df["VALUE"].to_numpy()[rows],
+		"WEIGHT": df["WEIGHT"].to_numpy()[rows],
+	})
+	group_values = aggregate_measures(group_df, ["area", "industry", "group", "DATA_TYPE"])
+	if group_values.empty:
+		return df
+	# a group and a row are the same series when area, industry, group code and data type agree
+	num_industries, num_groups, num_data_types = len(df["INDUSTRY_CODE"].cat.categories), len(group_uniques), len(data_types.categories)
+	def series_keys(area, industry, group, data_type):
+		return ((area*num_industries + industry)*num_groups + group)*num_data_types + data_type
+	index = group_values.index
+	group_keys = series_keys(
+		index.get_level_values("area").to_numpy(), index.get_level_values("industry").to_numpy(),
+		index.get_level_values("group").to_numpy(),
+		data_types.categories.get_indexer(index.get_level_values("DATA_TYPE").astype(object)))
+	row_groups = np.append(pd.Index(group_uniques).get_indexer(occ_categories), -1)[occ_codes]
+	row_keys = series_keys(area_codes, industry_codes, row_groups, data_types.codes.astype(np.int64))
+	positions = np.where(row_groups >= 0, pd.Index(group_keys).get_indexer(row_keys), -1)
+	group_values = group_values.to_numpy()[positions]
+	computed = (positions >= 0) & ~np.isnan(group_values)
+	df["VALUE"] = np.where(computed, group_values, df["VALUE"])
+	df["FLAG"] = df["FLAG"].where(~computed)
+	return df
+
+
+def compile_transformation_groups(transformation_groups, year):
+	# fold every group that applies to the year into one from_code -> to_code table;
+	# chained codes (2000 -> 2010 -> 2018) resolve exactly as sequential application would
+	table = {}
+	for transformation_group in transformation_groups:
+		if not transformation_group.operation(year, transformation_group.year):
+			continue
+		group_dict = {
+			trans.from_code: trans.to_code for trans in transformation_group.transformations
+		}
+		table = {from_code: group_dict.get(to_code, to_code) for from_code, to_code in table.items()}
+		for from_code, to_code in group_dict.items():
+			table.setdefault(from_code, to_code)
+	return table
+
+
+@lru_cache(maxsize=None)
+def get_occ_transformation_table(year: int) -> dict:
+	return compile_transformation_groups(CONSTANTS.transformation_groups, year)
+
+
+@lru_cache(maxsize=None)
+def get_degrouping_transformation_table(year: int) -> dict:
+	return compile_transformation_groups(CONSTANTS.degrouping_transformation_groups, year)
+
+
+def apply_transformation_table(transformation_table: dict, df: pd.DataFrame) -> pd.DataFrame:
+	# look up each distinct OCC_CODE once; the codes come back as a categorical
+	df["OCC_CODE"] = categorical_map(df["OCC_CODE"], lambda code: transformation_table.get(code, code))
 	return df
 
 
 def apply_transformation_group(
 		transformation_group: TransformationGroup,
 		df: pd.DataFrame) -> pd.DataFrame:
-	transformation_dict = {
-		trans.from_code: trans.to_code for trans in transformation_group.transformations
-	}
-	df["OCC_CODE"] = df["OCC_CODE"].apply(lambda x: transformation_dict.get(x, x))
-	
-	return df
+	transformation_table = compile_transformation_groups(
+		[transformation_group], transformation_group.year)
+	return apply_transformation_table(transformation_table, df)
 	
 
 def apply_occ_transformations(df: pd.DataFrame, year: str) -> pd.DataFrame:
-	year = int(year)
-	for transformation_group in CONSTANTS.transformation_groups:
-		year_condition = transformation_group.operation(year, transformation_group.year)
-		if year_condition:
-			df = apply_transformation_group(transformation_group, df)
-	
-	return df
+	return apply_transformation_table(get_occ_transformation_table(int(year)), df)
 
 
 def apply_degrouping_transformations(df: pd.DataFrame, year: str) -> pd.DataFrame:
-	year = int(year)
-	for transformation_group in CONSTANTS.degrouping_transformation_groups:
-		year_condition = transformation_group.operation(year, transformation_group.year)
-		if year_condition:
-			df = apply_transformation_group(transformation_group, df)
-	
-	return df
+	return apply_transformation_table(get_degrouping_transformation_table(int(year)), df)
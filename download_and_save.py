@@ -1,11 +1,12 @@
 
-import requests
+import argparse
 import zipfile
 import os
+import shutil
 import pandas as pd
-import time
-from config import DATA_FOLDER,FULL_FOLDER,NAT_FOLDER,STATE_FOLDER,METRO_FOLDER
-import io
+from config import DATA_FOLDER,FULL_FOLDER,NAT_FOLDER,STATE_FOLDER,METRO_FOLDER,DOWNLOAD_WORKERS,DOWNLOAD_MIN_INTERVAL
+from downloader import Downloader, DownloadJob
+from parse_cache import stringify_mixed_cols
 
 FULL_URLS = {
     '2019':'https://www.bls.gov/oes/special.requests/oesm19all.zip',    
@@ -64,6 +65,8 @@ METRO_URLS = {
     '2010':'https://www.bls.gov/oes/special.requests/oesm10ma.zip',
 }
 
+COPY_CHUNK_SIZE = 1024 * 1024
+
 ALL_URLS = {
     FULL_FOLDER:FULL_URLS,
     METRO_FOLDER:METRO_URLS,
@@ -71,24 +74,43 @@ ALL_URLS = {
     NAT_FOLDER:NATL_URLS,
 }
 
-def process_all():
-    # import pdb; pdb.set_trace()
+def process_all(workers=DOWNLOAD_WORKERS, min_interval=DOWNLOAD_MIN_INTERVAL):
+    downloader = Downloader(workers=workers, min_interval=min_interval)
+    jobs = {}
     for folder, urls_dict in ALL_URLS.items():
-        print('beginning', folder)
-        for year in urls_dict:
-            process_one_file(year, folder)
-            print('complete--wating...')
-            time.sleep(5)
+        for year, url in urls_dict.items():
+            job = DownloadJob(url=url, dest_path=get_zip_path(folder, year))
+            jobs[job] = (folder, year)
+    for result in downloader.download_all(jobs):
+        folder, year = jobs[result.job]
+        output_path = get_output_path(result.job.dest_path, folder)
+        if not result.changed and os.path.exists(output_path):
+            print('unchanged', folder, year)
+            continue
+        print('downloaded', folder, year, result.bytes_written, 'bytes')
+        process_zip_for(result.job.dest_path, year, folder)
 
 def make_dir(path):
     if not os.path.exists( path ):
         os.makedirs( path )
 
+def get_zip_path(folder, year):
+    return os.path.join( DATA_FOLDER, folder, year+'.zip' )
+
+def get_output_path(zip_path, folder):
+    # metro archives are merged into a directory of parquet parts, the rest unpack to one workbook
+    if folder==METRO_FOLDER:
+        return zip_path.replace('.zip','.parquet')
+    return zip_path.replace('.zip','.xlsx')
+
 def process_one_file(year,folder):
     url = ALL_URLS[ folder ][ year ]
     print('downloading', year)
     zip_path = download_zip_url(folder,year,url)
-    print('processing zip')
+    process_zip_for(zip_path, year, folder)
+
+def process_zip_for(zip_path, year, folder):
+    print('processing zip', zip_path)
     if (folder==METRO_FOLDER):
         if int(year)<=2004:
             return
@@ -96,52 +118,52 @@ def process_one_file(year,folder):
     else:
         process_zip( zip_path )
 
-def process_metro_zip(zip_path):        
-    xlsx_path = zip_path.replace('.zip','.xlsx')
-    dfs = []
+def process_metro_zip(zip_path):
+    # each member becomes one parquet part, so only one sheet is in memory at a time
+    parquet_path = get_output_path(zip_path, METRO_FOLDER)
+    tmp_path = parquet_path + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    make_dir(tmp_path)
     with zipfile.ZipFile(zip_path, 'r') as zipp:
-        for to_extract in zipp.infolist():
-            filename = to_extract.filename
-            if 'field_descriptions' in filename:
-                continue
-            data = zipp.open( to_extract.filename , 'r' ).read()
-            b = io.BytesIO( data )
-            df = pd.read_excel( b )
+        members = [m for m in zipp.infolist() if 'field_descriptions' not in m.filename]
+        for part, to_extract in enumerate(members):
+            member_path = extract_member(zipp, to_extract, tmp_path)
+            df = pd.read_excel( member_path )
+            os.remove( member_path )
             if 'BOS' in to_extract.filename:
                 df['AREA_TYPE'] = 6
             else:
                 df['AREA_TYPE'] = 5
-            dfs.append(df)
-    ret_df = pd.concat(dfs)
-    excel = pd.ExcelWriter(xlsx_path)
-    ret_df.to_excel( excel , 'data', index=False )
-    excel.close()
-
-def open_df_smart(filepath):
-	df = pd.read_excel(filepath)
-	num_fields = (~df.isna()).sum(axis=1)
-	min_val = num_fields.min()
-	if min_val>10:
-		return df
-	max_val = num_fields.max()
-	index = num_fields[ num_fields==max_val].index[0]
-	df = pd.read_excel(filepath,skiprows=0,header=index+1)
-	return df
+            df = stringify_mixed_cols(df)
+            df.to_parquet( os.path.join(tmp_path, 'part-{:03d}.parquet'.format(part)), index=False )
+    if os.path.exists(parquet_path):
+        shutil.rmtree(parquet_path)
+    os.rename(tmp_path, parquet_path)
+
+def extract_member(zipp, member, dest_folder):
+    dest_path = os.path.join( dest_folder, os.path.basename(member.filename) )
+    with zipp.open( member, 'r' ) as src, open(dest_path, 'wb') as dst:
+        shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+    return dest_path
 
 def process_zip( zip_path ):
     xlsx_path = zip_path.replace('.zip','.xlsx')
     with zipfile.ZipFile(zip_path, 'r') as zipp:
         to_extract = max( zipp.infolist() ,key=lambda x: x.file_size )
-        data = zipp.open( to_extract.filename , 'r' ).read()
-    with open(xlsx_path,'wb') as f:
-        f.write( data )
-
-def download_zip_url(folder, year, url):
-    subfolder = os.path.join( DATA_FOLDER, folder )
-    make_dir( subfolder )
-    dest_path = os.path.join( subfolder , year+'.zip' )
-    r = requests.get(url, allow_redirects=True)
-    open(dest_path, 'wb').write(r.content)
-    return dest_path
+        with zipp.open( to_extract.filename , 'r' ) as src, open(xlsx_path + '.tmp','wb') as dst:
+            shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+    os.replace(xlsx_path + '.tmp', xlsx_path)
+
+def download_zip_url(folder, year, url, downloader=None):
+    downloader = downloader or Downloader(workers=1)
+    result = downloader.download( DownloadJob(url=url, dest_path=get_zip_path(folder, year)) )
+    return result.job.dest_path
 
-process_all()
\ No newline at end of file
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Download and unpack the BLS OES archives')
+    parser.add_argument('--workers', type=int, default=DOWNLOAD_WORKERS)
+    parser.add_argument('--min-interval', type=float, default=DOWNLOAD_MIN_INTERVAL,
+                        help='minimum seconds between requests to the same host')
+    args = parser.parse_args()
+    process_all(workers=args.workers, min_interval=args.min_interval)
@@ -0,0 +1,163 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import NamedTuple
+from urllib.parse import urlparse
+
+import requests
+
+CHUNK_SIZE = 1024 * 1024
+PART_SUFFIX = '.part'
+META_SUFFIX = '.meta'
+VALIDATOR_HEADERS = {'etag': 'ETag', 'last_modified': 'Last-Modified', 'size': 'Content-Length'}
+
+
+class DownloadJob(NamedTuple):
+    url: str
+    dest_path: str
+
+
+class DownloadResult(NamedTuple):
+    job: DownloadJob
+    changed: bool
+    bytes_written: int
+
+
+class HostRateLimiter(object):
+    # Hands out request slots at most once every min_interval seconds per host,
+    # so concurrent workers never hit the same server faster than the old fixed sleep.
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_slot = {}
+
+    def wait(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class Downloader(object):
+    def __init__(self, workers=4, min_interval=1.0, session_factory=requests.Session, timeout=60):
+        self.workers = workers
+        self.limiter = HostRateLimiter(min_interval)
+        self.session_factory = session_factory
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def session(self):
+        # requests.Session is not thread safe, so each worker keeps its own
+        if not hasattr(self._local, 'session'):
+            self._local.session = self.session_factory()
+        return self._local.session
+
+    def download_all(self, jobs):
+        # yields results in completion order so callers can start processing early
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.download, job) for job in jobs]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def download(self, job):
+        dest_dir = os.path.dirname(job.dest_path)
+        if dest_dir:
+            os.makedirs(dest_dir, exist_ok=True)
+        meta = read_meta(job.dest_path)
+        headers = {}
+        if meta and os.path.exists(job.dest_path):
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        else:
+            meta = None
+        part_path = job.dest_path + PART_SUFFIX
+        part_meta = read_meta(part_path)
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if offset and part_meta:
+            headers['Range'] = 'bytes={}-'.format(offset)
+            validator = part_meta.get('etag') or part_meta.get('last_modified')
+            if validator:
+                headers['If-Range'] = validator
+        else:
+            offset = 0
+
+        self.limiter.wait(job.url)
+        with self.session().get(job.url, headers=headers, stream=True,
+                                allow_redirects=True, timeout=self.timeout) as r:
+            if r.status_code == 304:
+                return DownloadResult(job=job, changed=False, bytes_written=0)
+            if r.status_code == 416:
+                # stale partial file, start again from scratch
+                remove_if_exists(part_path)
+                remove_if_exists(part_path + META_SUFFIX)
+                return self.download(job)
+            r.raise_for_status()
+            validators = get_validators(r)
+            if meta and r.status_code == 200 and same_validators(meta, validators):
+                return DownloadResult(job=job, changed=False, bytes_written=0)
+            if r.status_code == 206:
+                mode = 'ab'
+                validators = part_meta
+            else:
+                mode = 'wb'
+                offset = 0
+                # the validators of a .part that no longer matches, if the body never arrives
+                remove_if_exists(part_path + META_SUFFIX)
+            written = 0
+            with open(part_path, mode) as f:
+                for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                    if chunk:
+                        f.write(chunk)
+                        if not written and mode == 'wb':
+                            # a .part is resumable once it has data and the validators it belongs to
+                            f.flush()
+                            write_meta(part_path, validators)
+                        written += len(chunk)
+
+        expected_size = validators.get('size')
+        if expected_size is not None and os.path.getsize(part_path) != int(expected_size):
+            raise IOError('incomplete download of {}: got {} of {} bytes'.format(
+                job.url, os.path.getsize(part_path), expected_size))
+        os.replace(part_path, job.dest_path)
+        write_meta(job.dest_path, validators)
+        remove_if_exists(part_path + META_SUFFIX)
+        return DownloadResult(job=job, changed=True, bytes_written=written)
+
+
+def get_validators(response):
+    validators = {key: response.headers.get(header) for key, header in VALIDATOR_HEADERS.items()}
+    if response.status_code == 206:
+        # Content-Range: bytes start-end/total
+        content_range = response.headers.get('Content-Range', '')
+        validators['size'] = content_range.rpartition('/')[2] or None
+    return {key: value for key, value in validators.items() if value is not None}
+
+
+def same_validators(old, new):
+    shared = [key for key in VALIDATOR_HEADERS if old.get(key) and new.get(key)]
+    return bool(shared) and all(old[key] == new[key] for key in shared)
+
+
+def read_meta(path):
+    try:
+        with open(path + META_SUFFIX) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def write_meta(path, meta):
+    with open(path + META_SUFFIX, 'w') as f:
+        json.dump(meta, f)
+
+
+def remove_if_exists(path):
+    if os.path.exists(path):
+        os.remove(path)
@@ -1,11 +1,23 @@
 
 from config import XLS_Constants, OE_Constants, CONSTANTS
-from config import DATA_FOLDER,FULL_FOLDER,NAT_FOLDER,STATE_FOLDER,METRO_FOLDER,DB_PATH,DATA_CODE_AGG_FUNCS, apply_occ_transformations, sum_groups_df, apply_degrouping_transformations
+from config import DATA_FOLDER,FULL_FOLDER,NAT_FOLDER,STATE_FOLDER,METRO_FOLDER,DB_PATH,WEIGHT_DATA_CODE,VALUE_FLAGS,SOC_GROUP_LEVELS,STREAM_CHUNK_ROWS, apply_occ_transformations, sum_groups_df, aggregate_measures, apply_degrouping_transformations, categorical_map, categorical_take
 import os
 import sqlite3
+import parse_cache
+import instrumentation
+from instrumentation import stage, instrumented
+from build_database_OE import migrate_value_flags, is_compact_schema, refresh_rollups, upsert_rollups, create_rollup_table, measure_agg_sql, rolled_up_data_types, rollup_slice_delete_sql
+from build_database_OE import apply_bulk_pragmas, drop_indexes, create_indexes, analyze, write_snapshot, SNAPSHOT_PAGE_SIZE
 import re
+import argparse
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import openpyxl
+import pyarrow.parquet as pq
+from openpyxl.utils.exceptions import InvalidFileException
+import numpy as np
 import pandas as pd
-import time
+import datetime
 
 _conn = sqlite3.connect(DB_PATH)
 
@@ -15,18 +27,72 @@ _data_u_want = _constants.data_u_want
 
 pd.set_option("display.width", 1000)
 
+HEADER_SCAN_ROWS = 50
+INGEST_DATA_TYPES = sorted(_column_heads['data_codes'])
+FLAG_SUFFIX = '_FLAG'
+FIX_COLS = {'OCC CODE':'OCC_CODE','OCC TITLE':'OCC_TITLE'}
+# temp tables of a streamed file: its long rows, then its group and series values
+STAGE_TABLE = 'ingest_stage'
+STAGE_GROUP_TABLE = 'ingest_stage_group'
+STAGE_SERIES_TABLE = 'ingest_stage_series'
+# the parts of a series code, carried as categoricals until the text is written to sqlite
+SERIES_CODE_PARTS = ['AREA_CODE', 'INDUSTRY_CODE', 'OCCUPATION_CODE', 'DATA_TYPE']
+# a row of the occupation group table, less its year
+ROLLUP_KEYS = ['AREA_CODE', 'INDUSTRY_CODE', 'DATA_TYPE', 'GROUP_TYPE', 'GROUP_CODE']
+
 # df[
 # 	(df["AREA_CODE"] == "N0000000") &
 # 	(df["INDUSTRY_CODE"] == "000000") &
 # 	(df["OCC_CODE"].str.endswith("0"))
 # ][["TOT_EMP", "OCC_CODE", "OCC_TITLE"]].OCC_CODE.value_counts()
 
-def process_all():
+def process_all(workers=1, force=False, data_type_codes=INGEST_DATA_TYPES, refresh_all_rollups=False,
+		stream=False, chunk_rows=STREAM_CHUNK_ROWS, build=False):
+	# transforms run in worker processes; this process is the only one writing to sqlite
+	create_manifest_table()
+	migrate_value_flags(_conn)
+	if build:
+		# streamed files are staged in temp tables, which stay on disk to keep memory bounded
+		apply_bulk_pragmas(_conn, **({'temp_store':'DEFAULT'} if stream else {}))
+		drop_indexes(_conn)
+	try:
+		tasks = [task for task in get_ingest_tasks() if force or not is_ingested(*task, data_type_codes)]
+		if stream:
+			# memory is bounded by the chunk size, so files go one at a time through this process
+			for task in tasks:
+				stream_file(*task, data_type_codes, chunk_rows)
+		elif workers > 1:
+			with ProcessPoolExecutor(max_workers=workers, initializer=instrumentation.configure_worker,
+					initargs=(instrumentation.settings(),)) as executor:
+				futures = {executor.submit(transform_task, *task, data_type_codes): task for task in tasks}
+				for future in as_completed(futures):
+					df, records = future.result()
+					instrumentation.extend(records)
+					write_results(df, *futures[future], data_type_codes)
+		else:
+			for task in tasks:
+				write_results(transform_file(*task, data_type_codes), *task, data_type_codes)
+		update_series_code_table()
+	finally:
+		# a failed load leaves what it committed, and queries on it still need the indexes
+		if build:
+			with stage('create_indexes'):
+				create_indexes(_conn)
+	# every file wrote the group rows of its own series; this rebuilds them all from value
+	if refresh_all_rollups:
+		with stage('rollup_tables') as s:
+			s.rows_out = refresh_rollups(None, _conn)
+
+def transform_task(*args):
+	# runs in a worker; the stage records travel back with the result
+	df = transform_file(*args)
+	return df, instrumentation.drain()
+
+def get_ingest_tasks():
 	for foldername in [FULL_FOLDER,NAT_FOLDER,STATE_FOLDER,METRO_FOLDER]:
-		print( 'folder',foldername )
 		subfolder_path = os.path.join( DATA_FOLDER,foldername )
 		filenames = os.listdir( subfolder_path )
-		excel_files = sorted( [f for f in filenames if f.endswith('xlsx')] )
+		excel_files = get_data_files( filenames )
 		for filename in excel_files:
 			year = filename.split('.')[0]
 			## before 2004, and metro before 2005 should be skipped
@@ -35,37 +101,261 @@ def process_all():
 			if int(year)<2004:
 				continue
 			filepath = os.path.join( subfolder_path, filename )
-			before = time.time()
-			# filename = "2019.xlsx"; foldername=FULL_FOLDER; subfolder_path = os.path.join( DATA_FOLDER,foldername ); filepath = os.path.join( subfolder_path, filename ); year = filename.split(".")[0]; data_type_code="01"
-			df_original = open_df_smart(filepath)
-			after = time.time()
-			print(filename)
-			print('df opened!')
-			print("time taken to open", after - before )
-			for data_type_code in ["01"]:
-				# translates column names
-				df = df_original.copy()
-				df = generate_basic_codes(df, year, foldername)
-				print("basic codes generated")
+			yield filepath, year, foldername, parse_cache.file_hash(filepath)
+
+def transform_file(filepath, year, foldername, source_hash=None, data_type_codes=INGEST_DATA_TYPES):
+	instrumentation.echo( 'folder',foldername, filepath )
+	labels = {'folder':foldername, 'year':year}
+	# filename = "2019.xlsx"; foldername=FULL_FOLDER; subfolder_path = os.path.join( DATA_FOLDER,foldername ); filepath = os.path.join( subfolder_path, filename ); year = filename.split(".")[0]
+	with stage('open', **labels) as s:
+		df = s.out(open_df_smart(filepath, ingest_columns(data_type_codes), digest=source_hash))
+	# the codes are worked out once on the wide frame, then every measure is melted into one long frame
+	with stage('basic_codes', df, **labels) as s:
+		df = s.out(generate_basic_codes(df, year, foldername))
+	with stage('numerify', df, **labels) as s:
+		for data_type_code in set(data_type_codes) | {WEIGHT_DATA_CODE}:
+			if _column_heads['data_codes'][data_type_code] in df.columns:
 				df = numerify_data_col(df, data_type_code)
-				print("data col numerified")				
-				df = apply_degrouping_transformations(df, year)
-				print("degrouping transformations applied")
-				df = deduplicate_df(df)
-				print("deduplicate df")
-				df = apply_occ_transformations(df, year)
-				print("transform occ_code dfs")
-				df = generate_series_codes(df, data_type_code)
-				print('codes generated!')
-				df = sum_groups_df(df)
-				print("calculate df groups from constituents")
-				insert_data(df, year, data_type_code)
-				print( 'data inserted!' )
+		s.out(df)
+	with stage('degroup', df, **labels) as s:
+		df = s.out(apply_degrouping_transformations(df, year))
+	with stage('dedupe', df, **labels) as s:
+		df = s.out(deduplicate_df(df))
+	with stage('occ_transform', df, **labels) as s:
+		df = s.out(apply_occ_transformations(df, year))
+	with stage('series_codes', df, **labels) as s:
+		df = s.out(melt_measures(generate_series_codes(df), data_type_codes))
+	with stage('rollup', df, **labels) as s:
+		df = s.out(sum_groups_df(df))
+	# only ship what insert_data needs back to the writer
+	return df[SERIES_CODE_PARTS + ['VALUE', 'WEIGHT', 'FLAG']]
+
+def write_results(df, filepath, year, foldername, source_hash, data_type_codes=INGEST_DATA_TYPES):
+	# values and their manifest entries commit together, so an interrupted run
+	# leaves the file unrecorded and the next run redoes it
+	with _conn:
+		with stage('insert', df, folder=foldername, year=year) as s:
+			series = series_values(df)
+			rows = insert_series(series, year)
+			s.rows_out = int(rows.sum())
+			for data_type_code in data_type_codes:
+				record_ingested(foldername, year, data_type_code, source_hash, int(rows.get(data_type_code, 0)))
+		with stage('rollup_table', series, folder=foldername, year=year) as s:
+			s.rows_out = insert_rollups(series, year)
+	instrumentation.echo( 'data inserted!', year, ','.join(data_type_codes) )
+
+def stream_file(filepath, year, foldername, source_hash, data_type_codes=INGEST_DATA_TYPES, chunk_rows=STREAM_CHUNK_ROWS):
+	# For files too big to hold whole: every chunk goes through the row-wise stages of transform_file
+	# into a temp table, and what needs the whole file (deduplication, group rollups and combining
+	# series) is done there in sql. Values and manifest entries still commit together.
+	instrumentation.echo( 'folder',foldername, filepath, 'streamed' )
+	labels = {'folder':foldername, 'year':year}
+	create_stage_tables()
+	try:
+		with _conn:
+			chunks = iter_chunks(filepath, ingest_columns(data_type_codes), chunk_rows)
+			while True:
+				with stage('read_chunk', **labels) as s:
+					df = s.out(next(chunks, None))
+				if df is None:
+					break
+				with stage('chunk', df, **labels) as s:
+					s.rows_out = stage_chunk(transform_chunk(df, year, foldername, data_type_codes))
+			with stage('stage_rollup', **labels) as s:
+				s.rows_out = rollup_stage()
+			with stage('insert', **labels) as s:
+				rows = insert_stage(year)
+				s.rows_out = int(rows.sum())
+				for data_type_code in data_type_codes:
+					record_ingested(foldername, year, data_type_code, source_hash, int(rows.get(data_type_code, 0)))
+			with stage('rollup_table', **labels) as s:
+				s.rows_out = upsert_rollups('temp.' + STAGE_SERIES_TABLE, year, _conn)
+	finally:
+		drop_stage_tables()
+	instrumentation.echo( 'data inserted!', year, ','.join(data_type_codes) )
+
+def iter_chunks(filepath, columns, chunk_rows=STREAM_CHUNK_ROWS):
+	# frames of at most chunk_rows rows with the columns parse_df_smart would give, in file order
+	if filepath.endswith('.parquet'):
+		for part in sorted( f for f in os.listdir(filepath) if f.endswith('.parquet') ):
+			parquet_file = pq.ParquetFile(os.path.join(filepath, part))
+			names = [name for name in parquet_file.schema_arrow.names if normalize_col_name(name) in columns]
+			for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=names):
+				yield fix_col_names( batch.to_pandas() )
+		return
+	header = find_header_row(filepath)
+	try:
+		wb = openpyxl.load_workbook(filepath, read_only=True, data_only=True)
+	except (InvalidFileException, zipfile.BadZipFile):
+		# legacy .xls holds at most 65536 rows, so it is read whole and only the pipeline is chunked
+		df = parse_df_smart(filepath, columns)
+		for start in range(0, len(df), chunk_rows):
+			yield df.iloc[start:start+chunk_rows].copy()
+		return
+	try:
+		rows = wb.worksheets[0].iter_rows(min_row=header+1, values_only=True)
+		names = [normalize_col_name(col) for col in next(rows)]
+		keep = [i for i, name in enumerate(names) if name in columns]
+		chunk = []
+		for row in rows:
+			values = [row[i] if i < len(row) else None for i in keep]
+			# read_excel skips blank lines as well
+			if any(value is not None for value in values):
+				chunk.append(values)
+			if len(chunk) == chunk_rows:
+				yield pd.DataFrame(chunk, columns=[names[i] for i in keep])
+				chunk = []
+		if chunk:
+			yield pd.DataFrame(chunk, columns=[names[i] for i in keep])
+	finally:
+		wb.close()
 
+def transform_chunk(df, year, foldername, data_type_codes=INGEST_DATA_TYPES):
+	# the row-wise stages of transform_file; ROW_KEY is what deduplicate_df would compare
+	df = generate_basic_codes(df, year, foldername)
+	for data_type_code in set(data_type_codes) | {WEIGHT_DATA_CODE}:
+		if _column_heads['data_codes'][data_type_code] in df.columns:
+			df = numerify_data_col(df, data_type_code)
+	df = deduplicate_df(apply_degrouping_transformations(df, year))
+	row_keys = code_text(df, ['AREA_CODE', 'INDUSTRY_CODE', 'OCC_CODE'])
+	df = apply_occ_transformations(df, year)
+	long_df = melt_measures(generate_series_codes(df), data_type_codes)
+	# melt stacks one block of rows per measure, each in the frame's order
+	long_df['ROW_KEY'] = np.tile(row_keys, len(long_df) // len(df)) if len(df) else []
+	return long_df
+
+def create_stage_tables():
+	# temp tables live in their own file, so a big file spills to disk rather than memory
+	drop_stage_tables()
+	_conn.execute("""CREATE TEMP TABLE {}
+					(row_key text not null,
+					series_code text not null,
+					data_type text not null,
+					value real,
+					weight real,
+					flag text,
+					primary key(row_key,data_type))""".format(STAGE_TABLE))
+	_conn.execute("""CREATE TEMP TABLE {}
+					(series_code text not null primary key,
+					value real)""".format(STAGE_GROUP_TABLE))
+	_conn.execute("""CREATE TEMP TABLE {}
+					(series_code text not null primary key,
+					data_type text not null,
+					value real,
+					flag text)""".format(STAGE_SERIES_TABLE))
+
+def drop_stage_tables():
+	for table in [STAGE_TABLE, STAGE_GROUP_TABLE, STAGE_SERIES_TABLE]:
+		_conn.execute("""DROP TABLE IF EXISTS temp.{}""".format(table))
+
+def stage_chunk(long_df):
+	# the first row of a key wins, across chunks as deduplicate_df does within a frame
+	n = len(long_df)
+	rows = zip(
+		long_df['ROW_KEY'].tolist(),
+		series_code_text(long_df).tolist(),
+		long_df['DATA_TYPE'].astype(object).tolist(),
+		long_df['VALUE'].astype(object).where(long_df['VALUE'].notna(), None).tolist(),
+		long_df['WEIGHT'].astype(float).astype(object).where(long_df['WEIGHT'].notna(), None).tolist(),
+		long_df['FLAG'].astype(object).where(long_df['FLAG'].notna(), None).tolist(),
+	)
+	_conn.executemany("""INSERT OR IGNORE INTO {} (row_key,series_code,data_type,value,weight,flag)
+					VALUES (?,?,?,?,?,?)""".format(STAGE_TABLE), rows)
+	return n
+
+def rollup_stage():
+	# sum_groups_df in sql: every SOC group code of a detailed row, with the same keep rule,
+	# gets the value of its rows, and the staged rows of a group with a value take it
+	_conn.execute("""CREATE INDEX temp.{0}_series_idx ON {0} (series_code)""".format(STAGE_TABLE))
+	levels = ' UNION ALL '.join('SELECT {} AS zeros'.format(num_zeros) for num_zeros in SOC_GROUP_LEVELS)
+	_conn.execute("""INSERT INTO {group_table} (series_code,value)
+					SELECT m.series_code,{agg}
+					FROM (SELECT substr(s.series_code,1,17+6-l.zeros) || substr('000000',1,l.zeros) || s.data_type AS series_code,
+						s.data_type AS data_type,
+						s.value AS value,
+						s.weight AS weight
+						FROM {stage_table} s
+						CROSS JOIN ({levels}) l
+						WHERE substr(s.series_code,23,1) != '0'
+						AND s.data_type IN ({data_types})
+						AND (l.zeros = {top} OR substr(s.series_code,23-l.zeros,1) != '0')) m
+					GROUP BY m.series_code""".format(
+						group_table=STAGE_GROUP_TABLE, stage_table=STAGE_TABLE, levels=levels, agg=measure_agg_sql(),
+						top=SOC_GROUP_LEVELS[-1], data_types=','.join("'{}'".format(code) for code in rolled_up_data_types())))
+	cur = _conn.execute("""UPDATE {stage_table}
+					SET value = (SELECT g.value FROM {group_table} g WHERE g.series_code = {stage_table}.series_code),
+					flag = NULL
+					WHERE series_code IN (SELECT series_code FROM {group_table} WHERE value IS NOT NULL)""".format(
+						stage_table=STAGE_TABLE, group_table=STAGE_GROUP_TABLE))
+	return cur.rowcount
+
+def insert_stage(year):
+	# insert_data in sql: rows of a series combine by their measure's function, a series without
+	# a value keeps the marker of its first suppressed row, and blank series are left out
+	_conn.execute("""INSERT INTO {series_table} (series_code,data_type,value,flag)
+					SELECT * FROM (
+						SELECT a.series_code,a.data_type,a.value,
+						CASE WHEN a.value IS NULL THEN
+							(SELECT f.flag FROM {stage_table} f
+							WHERE f.series_code = a.series_code AND f.value IS NULL AND f.flag IS NOT NULL
+							ORDER BY f.rowid LIMIT 1) END AS flag
+						FROM (SELECT m.series_code AS series_code,m.data_type AS data_type,{agg} AS value
+							FROM {stage_table} m
+							GROUP BY m.series_code) a)
+					WHERE value IS NOT NULL OR flag IS NOT NULL""".format(
+						series_table=STAGE_SERIES_TABLE, stage_table=STAGE_TABLE, agg=measure_agg_sql()))
+	_conn.execute(value_upsert_sql("""SELECT series_code,?,'A01',?,value,flag FROM {} WHERE true""".format(STAGE_SERIES_TABLE)),
+		(year, year+'-01-01'))
+	counts = _conn.execute("""SELECT data_type,count(*) FROM {} GROUP BY 1""".format(STAGE_SERIES_TABLE)).fetchall()
+	return pd.Series(dict(counts), dtype=np.int64)
+
+def create_manifest_table():
+	_conn.execute("""CREATE TABLE IF NOT EXISTS {}
+					(folder text not null,
+					year integer not null,
+					data_type text not null,
+					source_hash text not null,
+					rows integer not null,
+					ingested_at text not null,
+					primary key(folder,year,data_type))""".format(OE_Constants.MANIFEST_TABLE))
+	_conn.commit()
+
+def is_ingested(filepath, year, foldername, source_hash, data_type_codes=INGEST_DATA_TYPES):
+	ret = _conn.execute("""SELECT count(*) FROM {} WHERE folder=? AND year=? AND source_hash=?
+			AND data_type IN ({})""".format(OE_Constants.MANIFEST_TABLE, ','.join('?'*len(data_type_codes))),
+			(foldername, year, source_hash, *data_type_codes)).fetchall()
+	return ret[0][0] == len(set(data_type_codes))
+
+def record_ingested(foldername, year, data_type_code, source_hash, rows):
+	_conn.execute("""INSERT INTO {} (folder,year,data_type,source_hash,rows,ingested_at)
+					VALUES (?,?,?,?,?,?)
+					ON CONFLICT(folder,year,data_type) DO UPDATE SET
+					source_hash=excluded.source_hash,
+					rows=excluded.rows,
+					ingested_at=excluded.ingested_at""".format(OE_Constants.MANIFEST_TABLE),
+		(foldername, year, data_type_code, source_hash, rows, datetime.datetime.now().isoformat(timespec='seconds')))
+
+
+def get_data_files(filenames):
+	# metro years are unpacked to parquet parts; prefer them over an older merged xlsx
+	by_year = {}
+	for f in sorted(filenames):
+		if f.endswith('xlsx') or f.endswith('.parquet'):
+			year = f.split('.')[0]
+			if year not in by_year or f.endswith('.parquet'):
+				by_year[year] = f
+	return [by_year[year] for year in sorted(by_year)]
 
 def numerify_data_col(df, data_type_code):
+	# footnote markers fail the coercion and are kept in a flag column; only those cells are looked at
 	data_head = _column_heads['data_codes'][data_type_code]
-	df[data_head] = pd.to_numeric(df[data_head], errors="coerce")
+	raw = df[data_head]
+	values = pd.to_numeric(raw, errors="coerce")
+	failed = (values.isna() & raw.notna()).to_numpy()
+	flags = np.full(len(df), None, dtype=object)
+	flags[failed] = raw[failed].astype(str).str.strip().to_numpy()
+	df[data_head] = values
+	df[data_head + FLAG_SUFFIX] = pd.Categorical(flags, categories=VALUE_FLAGS)
 	return df
 
 def deduplicate_df(df):
@@ -74,74 +364,249 @@ def deduplicate_df(df):
 
 def generate_basic_codes(df, year, foldername):
 	try:
-		df['INDUSTRY_CODE'] = df[ _column_heads ['other_codes']['industry_code'] ].apply(interpret_industry_code)
+		df['INDUSTRY_CODE'] = get_industry_codes( df[ _column_heads ['other_codes']['industry_code'] ] )
 	except Exception as e:
 		print(e)
-		df['INDUSTRY_CODE'] = '000000'
-	df['AREA_CODE'] = df.apply( get_area_code_enclosure(year, foldername),axis=1 )
+		df['INDUSTRY_CODE'] = constant_categorical(OE_Constants.ALL_INDUSTRY_CODE, len(df))
+	df['AREA_CODE'] = get_area_codes(df, foldername)
 	return df
 
-def generate_series_codes(df, data_type_code):
-	df['OCCUPATION_CODE'] = df[ _column_heads ['other_codes']['occupation_code'] ].apply( rem_hyphen )
-	series_code_start = OE_Constants.SERIES_PREFIX + df.AREA_CODE + df.INDUSTRY_CODE + df.OCCUPATION_CODE
-	df['SERIES_CODE'] = series_code_start + data_type_code
+def constant_categorical(value, n):
+	return pd.Categorical.from_codes(np.zeros(n, dtype=np.int8), [value])
+
+def get_industry_codes(naics):
+	# a file has at most a few hundred distinct NAICS values, so interpret each once
+	return categorical_map(naics, interpret_industry_code)
+
+def get_area_codes(df, foldername):
+	# the area code of each distinct area (and area type), as a categorical
+	if foldername==NAT_FOLDER:
+		return constant_categorical(OE_Constants.NATIONAL_AREA_CODE, len(df))
+	columns = [ _column_heads['other_codes']['area'] ]
+	if foldername!=STATE_FOLDER:
+		columns.append( _column_heads['other_codes']['area_type'] )
+	codes, uniques = pd.MultiIndex.from_frame(df[columns]).factorize()
+	return categorical_take(codes, area_code_strings(uniques.set_names(columns).to_frame(index=False), foldername))
+
+def area_code_strings(df, foldername):
+	# column-wise equivalent of get_area_code_from_row
+	area = df[ _column_heads['other_codes']['area'] ].astype(str)
+	if foldername==STATE_FOLDER:
+		return 'S' + area.str.zfill(2) + '00000'
+	area_type = df[ _column_heads['other_codes']['area_type'] ]
+	conditions = [
+		area_type == 1,
+		area_type.isin([2,3]),
+		area_type.isin([4,5]),
+		area_type == 6,
+	]
+	choices = [
+		pd.Series(OE_Constants.NATIONAL_AREA_CODE, index=df.index),
+		'S' + area.str.zfill(2) + '00000',
+		'M00' + area.str.zfill(5),
+		'M' + area.str.zfill(7),
+	]
+	matched = np.logical_or.reduce(conditions)
+	if not matched.all():
+		raise ValueError('unexpected AREA_TYPE values: {}'.format(area_type[~matched].unique()))
+	return pd.Series(np.select(conditions, choices, default=''), index=df.index)
+
+def generate_series_codes(df):
+	# the occupation part of the series code; the code itself is only put together by series_code_text
+	df['OCCUPATION_CODE'] = categorical_map( df[ _column_heads ['other_codes']['occupation_code'] ], rem_hyphen )
 	return df
 
-def insert_data(df, year, data_type_code):
-	groupby_fun = DATA_CODE_AGG_FUNCS[data_type_code]
-	data_head = _column_heads['data_codes'][data_type_code]
-	temp_df = df[[ data_head , 'SERIES_CODE' ]].reset_index(drop=True)
-	temp_df['series_code'] = temp_df['SERIES_CODE']
-	temp_df['period'] = 'A01'
-	temp_df['year'] = year
-	temp_df['data_date'] = year+'-01-01'
-	temp_df['value'] = temp_df[data_head]
-	temp_df = temp_df[['series_code','year','period','data_date','value']][ temp_df.value.apply( lambda x: '*' not in str(x) ) ]
-	agg_df = temp_df.groupby(['series_code','year','period','data_date']).agg( {'value':groupby_fun} )
-	agg_df = agg_df.reset_index()
-	agg_df.to_sql( 'value', _conn, if_exists='append', index=False )
+def code_text(df, columns, prefix=''):
+	# columns, categorical or not, joined into one string per row
+	text = np.full(len(df), prefix, dtype=object)
+	for column in columns:
+		text = text + np.asarray(df[column], dtype=object)
+	return text
+
+def series_code_text(df):
+	return code_text(df, SERIES_CODE_PARTS, OE_Constants.SERIES_PREFIX)
+
+def melt_measures(df, data_type_codes):
+	# one row per series and measure; employment rides along as the weight of the wage means.
+	# The code columns are tiled as categorical codes, one block of rows per measure.
+	heads = [(_column_heads['data_codes'][code], code) for code in data_type_codes
+			if _column_heads['data_codes'][code] in df.columns]
+	weight_head = _column_heads['data_codes'][WEIGHT_DATA_CODE]
+	n = len(df)
+	weights = df[weight_head].to_numpy(dtype=float) if weight_head in df.columns else np.full(n, np.nan)
+	long_df = pd.DataFrame({
+		column: pd.Categorical.from_codes(np.tile(df[column].cat.codes.to_numpy(), len(heads)), df[column].cat.categories)
+		for column in SERIES_CODE_PARTS[:-1]})
+	long_df['DATA_TYPE'] = pd.Categorical.from_codes(np.repeat(np.arange(len(heads), dtype=np.int8), n), [code for _, code in heads])
+	long_df['VALUE'] = np.concatenate([df[head].to_numpy(dtype=float) for head, _ in heads]) if heads else np.array([])
+	long_df['WEIGHT'] = np.tile(weights, len(heads))
+	flags = [df[head + FLAG_SUFFIX].to_numpy(dtype=object) for head, _ in heads]
+	long_df['FLAG'] = pd.Categorical(np.concatenate(flags) if flags else [], categories=VALUE_FLAGS)
+	return long_df
+
+def insert_data(df, year):
+	return insert_series(series_values(df), year)
+
+def series_values(df):
+	# occupation crosswalks can map several codes onto one series, combined as their measure's groups are
+	keys = SERIES_CODE_PARTS
+	values = aggregate_measures(df, keys)
+	# a series left without a value keeps the marker of its suppressed cell
+	suppressed = df[ df.VALUE.isna() & df.FLAG.notna() ]
+	if len(suppressed):
+		flags = suppressed.groupby(keys, sort=False, observed=True)['FLAG'].first().reindex(values.index)
+	else:
+		# the groupby of no rows has keys of other code widths than values', which reindex rejects
+		flags = pd.Series(None, index=values.index, dtype=df['FLAG'].dtype)
+	agg_df = pd.DataFrame({'value':values, 'flag':flags.where(values.isna())}).reset_index()
+	# cells that were blank, rather than footnoted, have nothing to record
+	return agg_df[ agg_df.value.notna() | agg_df.flag.notna() ]
+
+def insert_series(agg_df, year):
+	n = len(agg_df)
+	rows = zip(
+		series_code_text(agg_df).tolist(),
+		[year]*n,
+		['A01']*n,
+		[year+'-01-01']*n,
+		agg_df['value'].astype(object).where(agg_df['value'].notna(), None).tolist(),
+		agg_df['flag'].astype(object).where(agg_df['flag'].notna(), None).tolist(),
+	)
+	_conn.executemany( value_upsert_sql(), rows )
+	return agg_df['DATA_TYPE'].astype(object).value_counts()
+
+def rollup_frame(series, occ_groups):
+	# rollup_sql on the series of one file, from series_values: detailed occupations roll up into
+	# their SOC major and minor groups, occupations in occ_groups (code -> group name) into their
+	# named group, and wage means are weighted by the employment of the same area, industry and occupation
+	member_keys = SERIES_CODE_PARTS[:-1]
+	weights = series[ series['DATA_TYPE'] == WEIGHT_DATA_CODE ]
+	positions = pd.MultiIndex.from_frame(weights[member_keys]).get_indexer(pd.MultiIndex.from_frame(series[member_keys]))
+	members = series.assign(VALUE=series['value'], WEIGHT=np.append(weights['value'].to_numpy(dtype=float), np.nan)[positions])
+	members = members[ members['DATA_TYPE'].isin(rolled_up_data_types()) ]
+	# group codes are worked out per occupation category, with a trailing None for code -1
+	occupations = pd.Series(np.asarray(members['OCCUPATION_CODE'].cat.categories, dtype=object))
+	detailed = ~occupations.str.endswith('0')
+	group_codes = {
+		'major': (occupations.str.slice(stop=2) + '0000').where(detailed),
+		'minor': (occupations.str.slice(stop=3) + '000').where(detailed & (occupations.str.get(2) != '0')),
+		'occ_group': occupations.map(occ_groups),
+	}
+	occ_codes = members['OCCUPATION_CODE'].cat.codes.to_numpy()
+	frames = []
+	for group_type, codes in group_codes.items():
+		group_code = np.append(codes.to_numpy(dtype=object), None)[occ_codes]
+		rows = pd.notna(group_code)
+		frames.append(members.loc[rows, ['AREA_CODE', 'INDUSTRY_CODE', 'DATA_TYPE', 'VALUE', 'WEIGHT']].assign(
+			GROUP_TYPE=group_type, GROUP_CODE=group_code[rows]))
+	group_df = pd.concat(frames, ignore_index=True)
+	values = aggregate_measures(group_df, ROLLUP_KEYS)
+	counts = group_df.groupby(ROLLUP_KEYS, sort=False, observed=True)['VALUE'].count().reindex(values.index)
+	return pd.DataFrame({'value':values, 'members':counts}).reset_index()
+
+def insert_rollups(series, year):
+	# the group rows of one file's series replace those of its areas, industries and data types
+	occ_groups = dict(_conn.execute("""SELECT code,group_name FROM occ_group""").fetchall())
+	rollup = rollup_frame(series, occ_groups)
+	create_rollup_table(_conn)
+	slices = series.loc[ series['DATA_TYPE'].isin(rolled_up_data_types()), ['AREA_CODE', 'INDUSTRY_CODE', 'DATA_TYPE'] ].drop_duplicates()
+	_conn.executemany(rollup_slice_delete_sql(),
+		zip([int(year)]*len(slices), *[slices[key].astype(object).tolist() for key in slices.columns]))
+	n = len(rollup)
+	rows = zip(*[rollup[key].astype(object).tolist() for key in ROLLUP_KEYS],
+		[int(year)]*n,
+		rollup['value'].astype(object).where(rollup['value'].notna(), None).tolist(),
+		rollup['members'].astype(int).tolist(),
+	)
+	_conn.executemany("""INSERT INTO {}
+			(area_code,industry_code,data_type,group_type,group_code,year,value,members)
+			VALUES (?,?,?,?,?,?,?,?)""".format(OE_Constants.ROLLUP_TABLE), rows)
+	return n
+
+def value_upsert_sql(rows_sql="""VALUES (?,?,?,?,?,?)"""):
+	# the compact schema's value is a view, whose insert trigger upserts by itself;
+	# a SELECT as rows_sql needs a WHERE clause for sqlite to parse the upsert after it
+	ret = _conn.execute("""SELECT type FROM sqlite_master WHERE name=?""", (OE_Constants.VALUE_TABLE,)).fetchall()
+	sql = """INSERT INTO {} (series_code,year,period,data_date,value,flag) {}""".format(OE_Constants.VALUE_TABLE, rows_sql)
+	if ret and ret[0][0] == 'view':
+		return sql
+	return sql + """
+			ON CONFLICT(series_code,data_date) DO UPDATE SET
+			year=excluded.year,
+			period=excluded.period,
+			value=excluded.value,
+			flag=excluded.flag"""
+
+def normalize_col_name(col):
+	col = str(col).upper()
+	return FIX_COLS.get(col, col)
 
 def fix_col_names(arg_df):
-	arg_df.columns = [col.upper() for col in arg_df.columns]
-	fix_cols = {'OCC CODE':'OCC_CODE','OCC TITLE':'OCC_TITLE'}
-	for col in fix_cols:
-		if col in arg_df.columns:
-			arg_df = arg_df.rename( columns={col:fix_cols[col]} )
+	arg_df.columns = [normalize_col_name(col) for col in arg_df.columns]
 	return arg_df
 
-def open_df_smart(filepath):
-	df = pd.read_excel(filepath)
-	num_fields = (~df.isna()).sum(axis=1)
-	min_val = num_fields.min()
-	if min_val>10:
-		df = fix_col_names( df )
+def ingest_columns(data_type_codes):
+	# the code columns plus the measure columns the pipeline actually reads, and employment for the weights
+	columns = set(_column_heads['other_codes'].values())
+	columns.update(_column_heads['data_codes'][code] for code in set(data_type_codes) | {WEIGHT_DATA_CODE})
+	return columns
+
+def read_parquet_parts(path):
+	parts = sorted( f for f in os.listdir(path) if f.endswith('.parquet') )
+	df = pd.concat( [pd.read_parquet(os.path.join(path, f)) for f in parts], ignore_index=True )
+	return df
+
+def open_df_smart(filepath, columns=None, digest=None):
+	variant = ','.join(sorted(columns)) if columns else ''
+	return parse_cache.cached_parse(filepath, lambda path: parse_df_smart(path, columns), digest=digest, variant=variant)
+
+def parse_df_smart(filepath, columns=None):
+	if filepath.endswith('.parquet'):
+		df = fix_col_names( read_parquet_parts(filepath) )
+		if columns:
+			df = df[[col for col in df.columns if col in columns]]
 		return df
-	max_val = num_fields.max()
-	index = num_fields[ num_fields==max_val ].index[0]
-	df = pd.read_excel(filepath,skiprows=0,header=index+1)
+	usecols = None
+	if columns:
+		usecols = lambda col: normalize_col_name(col) in columns
+	header = find_header_row(filepath)
+	df = pd.read_excel(filepath, header=header, usecols=usecols)
 	df = fix_col_names( df )
 	return df
 
-def update_series_code_table():
-	cur = _conn.execute( """SELECT distinct series_code FROM VALUE""" )
-	value_codes = cur.fetchall()
-	values_df = pd.DataFrame(value_codes)
-	values_df.columns = ['code']
-	split_codes = [(x[17:23],x[11:17],x[3:11],x[23:25]) for x in values_df.code]
-	split_df = pd.DataFrame(split_codes)
-	split_df.columns = ['occupation_code','industry_code','area_code','data_type']
-	values_df[['occupation_code','industry_code','area_code','data_type']] = split_df
-	values_df['complete'] = True
-	values_df['exist'] = True
-	cur = _conn.execute( """SELECT code FROM SERIES_CODE""" )
-	series_codes = cur.fetchall()
-	series_codes_list = [r[0] for r in series_codes]
-	to_insert_df = values_df[ ~values_df.code.isin(series_codes_list) 
-							].reset_index(drop=True)[
-							['code','occupation_code','industry_code',
-							'area_code','data_type','complete','exist']]
-	to_insert_df.to_sql( 'series_code', _conn, if_exists='append', index=False )
+def find_header_row(filepath, scan_rows=HEADER_SCAN_ROWS):
+	# some years have title rows above the header; the header is the first
+	# of the leading rows with the most filled-in cells
+	num_fields = count_leading_fields(filepath, scan_rows)
+	return num_fields.index( max(num_fields) )
 
+def count_leading_fields(filepath, scan_rows):
+	try:
+		wb = openpyxl.load_workbook(filepath, read_only=True, data_only=True)
+	except (InvalidFileException, zipfile.BadZipFile):
+		# legacy .xls content, which openpyxl cannot stream
+		df = pd.read_excel(filepath, header=None, nrows=scan_rows)
+		return (~df.isna()).sum(axis=1).tolist()
+	try:
+		rows = wb.worksheets[0].iter_rows(max_row=scan_rows, values_only=True)
+		return [sum(value is not None and value != '' for value in row) for row in rows]
+	finally:
+		wb.close()
+
+@instrumented('update_series_codes')
+def update_series_code_table():
+	# one pass in sqlite: the distinct codes stream off the value primary key, so nothing is held in memory
+	if is_compact_schema(_conn):
+		# the value insert trigger has already created every series
+		return 0
+	with _conn:
+		cur = _conn.execute("""INSERT INTO series_code
+				(code,occupation_code,industry_code,area_code,data_type,complete,exist)
+				SELECT v.series_code,substr(v.series_code,18,6),substr(v.series_code,12,6),
+				substr(v.series_code,4,8),substr(v.series_code,24,2),1,1
+				FROM (SELECT DISTINCT series_code FROM {}) v
+				WHERE NOT EXISTS (SELECT 1 FROM series_code sc WHERE sc.code = v.series_code)""".format(OE_Constants.VALUE_TABLE))
+	return cur.rowcount
 
 def rem_hyphen(s):
 	return s.replace('-','')
@@ -199,6 +664,9 @@ def interpret_industry_code(ic):
 			code = ic1 + '--' + str(int(ic2)+1).zfill(2)
 		elif len(ic) == 6:
 			code = ic
+		elif re.match(r'^0+$',ic):
+			# the cross-industry code 000000 is read as the number 0
+			code = OE_Constants.ALL_INDUSTRY_CODE
 		else:
 			input('unexpected industry_code:',ic)
 			raise KeyError
@@ -209,5 +677,49 @@ def interpret_industry_code(ic):
 		input('pause')
 
 if __name__ == '__main__':
-	process_all()
-	update_series_code_table()
+	parser = argparse.ArgumentParser(description='Load the downloaded OES files into the database')
+	parser.add_argument('--workers', type=int, default=1,
+						help='number of processes transforming files in parallel')
+	parser.add_argument('--force', action='store_true',
+						help='reprocess files already recorded in the ingest manifest')
+	parser.add_argument('--refresh-rollups', action='store_true',
+						help='rebuild the occupation group table of every year from the value table')
+	parser.add_argument('--stream', action='store_true',
+						help='read files in chunks and combine them in sqlite, for files too big to load whole')
+	parser.add_argument('--chunk-rows', type=int, default=STREAM_CHUNK_ROWS,
+						help='rows per chunk with --stream')
+	parser.add_argument('--build', action='store_true',
+						help='bulk load: no journal syncs, and the secondary indexes dropped until the load is done')
+	parser.add_argument('--snapshot', metavar='PATH',
+						help='finally write a vacuumed, read-only copy of the database to PATH')
+	parser.add_argument('--page-size', type=int, default=SNAPSHOT_PAGE_SIZE,
+						help='page size of the --snapshot copy')
+	parser.add_argument('--data-types', nargs='+', default=INGEST_DATA_TYPES,
+						choices=sorted(_column_heads['data_codes']), metavar='CODE',
+						help='data type codes to load (default: all of them)')
+	parser.add_argument('--instrument-json', metavar='PATH',
+						help='append a JSON line per pipeline stage to PATH')
+	parser.add_argument('--summary', action='store_true',
+						help='print per-stage totals at the end')
+	parser.add_argument('--quiet', action='store_true',
+						help='do not print a line per pipeline stage')
+	parser.add_argument('--profile-stage', action='append', default=[], metavar='STAGE',
+						help='run STAGE under cProfile and save a .prof per file; * for every stage')
+	parser.add_argument('--trace-memory-stage', action='append', default=[], metavar='STAGE',
+						help='record the tracemalloc peak of STAGE; * for every stage')
+	args = parser.parse_args()
+	instrumentation.configure(jsonl_path=args.instrument_json, echo=not args.quiet,
+		profile_stages=args.profile_stage, trace_memory_stages=args.trace_memory_stage)
+	process_all(workers=args.workers, force=args.force, data_type_codes=args.data_types,
+		refresh_all_rollups=args.refresh_rollups, stream=args.stream, chunk_rows=args.chunk_rows, build=args.build)
+	with stage('analyze'):
+		analyze(_conn)
+	if args.build:
+		# the database file is complete on its own again
+		_conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+	if args.snapshot:
+		with stage('snapshot'):
+			size = write_snapshot(args.snapshot, args.page_size, _conn)
+		print('wrote {} ({:.1f} MB)'.format(args.snapshot, size / 1024**2))
+	if args.summary:
+		print(instrumentation.summary())
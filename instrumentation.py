@@ -0,0 +1,172 @@
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import resource
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# stage names that select every stage in profile_stages and trace_memory_stages
+ALL_STAGES = '*'
+PROFILE_TOP = 20
+# everything else in a record is a label, such as folder and year
+RECORD_FIELDS = {'stage', 'wall_seconds', 'cpu_seconds', 'rows_in', 'rows_out', 'rss_delta_mb', 'peak_traced_mb', 'profile'}
+
+_settings = {
+	'jsonl_path': None,
+	'echo': True,
+	'profile_stages': (),
+	'trace_memory_stages': (),
+	'profile_dir': '.',
+}
+_records = []
+
+def configure(jsonl_path=None, echo=True, profile_stages=(), trace_memory_stages=(), profile_dir='.'):
+	# jsonl_path gets one JSON line per finished stage; echo prints a line per stage as well.
+	# profile_stages run under cProfile and trace_memory_stages under tracemalloc, both slow them down.
+	_settings.update(
+		jsonl_path=jsonl_path,
+		echo=echo,
+		profile_stages=tuple(profile_stages),
+		trace_memory_stages=tuple(trace_memory_stages),
+		profile_dir=profile_dir,
+	)
+
+def settings():
+	return dict(_settings)
+
+def echo(*values):
+	# progress lines that --quiet silences along with the stage lines
+	if _settings['echo']:
+		print(*values)
+
+def configure_worker(parent_settings):
+	# a pool initializer: the parent's settings, except that the parent writes the JSON lines
+	# of the records a worker hands over with drain()
+	configure(**dict(parent_settings, jsonl_path=None))
+
+def rss_bytes():
+	# current resident set size; where /proc is missing, the peak is the best there is
+	try:
+		with open('/proc/self/statm') as f:
+			return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+	except (IOError, ValueError, AttributeError):
+		return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def selected(name, stages):
+	return name in stages or ALL_STAGES in stages
+
+def count_rows(obj):
+	if obj is None or isinstance(obj, int):
+		return obj
+	return len(obj) if hasattr(obj, '__len__') else None
+
+class StageRecord(object):
+	def __init__(self, name, labels, rows_in):
+		self.name = name
+		self.labels = labels
+		self.rows_in = count_rows(rows_in)
+		self.rows_out = None
+
+	def out(self, result):
+		# records the size of a stage's result and passes it on
+		self.rows_out = count_rows(result)
+		return result
+
+@contextmanager
+def stage(name, rows_in=None, **labels):
+	# rows_in is a row count or anything with a length, e.g. the frame going in
+	record = StageRecord(name, labels, rows_in)
+	profiler = cProfile.Profile() if selected(name, _settings['profile_stages']) else None
+	tracing = selected(name, _settings['trace_memory_stages']) and not tracemalloc.is_tracing()
+	if tracing:
+		tracemalloc.start()
+	rss_before = rss_bytes()
+	before, cpu_before = time.perf_counter(), time.process_time()
+	if profiler:
+		profiler.enable()
+	try:
+		yield record
+	finally:
+		if profiler:
+			profiler.disable()
+		result = dict(labels,
+			stage=name,
+			wall_seconds=round(time.perf_counter() - before, 4),
+			cpu_seconds=round(time.process_time() - cpu_before, 4),
+			rows_in=record.rows_in,
+			rows_out=record.rows_out,
+			rss_delta_mb=round((rss_bytes() - rss_before) / 1024**2, 1),
+		)
+		if tracing:
+			result['peak_traced_mb'] = round(tracemalloc.get_traced_memory()[1] / 1024**2, 1)
+			tracemalloc.stop()
+		if profiler:
+			result['profile'] = dump_profile(profiler, name, labels)
+		add(result)
+
+def instrumented(name):
+	# decorator form of stage(); rows come from the first argument and the return value
+	def decorator(func):
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			with stage(name, args[0] if args else None) as record:
+				return record.out(func(*args, **kwargs))
+		return wrapper
+	return decorator
+
+def dump_profile(profiler, name, labels):
+	path = os.path.join(_settings['profile_dir'], '-'.join([name] + [str(v) for v in labels.values()]) + '.prof')
+	profiler.dump_stats(path)
+	out = io.StringIO()
+	pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_TOP)
+	print(out.getvalue())
+	return path
+
+def add(record, echo=None):
+	_records.append(record)
+	if _settings['jsonl_path']:
+		with open(_settings['jsonl_path'], 'a') as f:
+			f.write(json.dumps(record) + '\n')
+	if _settings['echo'] if echo is None else echo:
+		labels = ' '.join(str(v) for k, v in record.items() if k not in RECORD_FIELDS)
+		print('{} {:<16} {:>8.3f}s cpu {:>8.3f}s rows {} -> {}'.format(
+			labels, record['stage'], record['wall_seconds'], record['cpu_seconds'], record['rows_in'], record['rows_out']))
+
+def drain():
+	# hands this process's records over, e.g. from a worker to the process that reports them
+	records = list(_records)
+	del _records[:]
+	return records
+
+def extend(records):
+	# records made elsewhere have already been echoed there
+	for record in records:
+		add(record, echo=False)
+
+def records():
+	return list(_records)
+
+def summary(stage_records=None):
+	# totals per stage, slowest first
+	stage_records = _records if stage_records is None else stage_records
+	totals = {}
+	for record in stage_records:
+		total = totals.setdefault(record['stage'], {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'rows_in': 0, 'rows_out': 0})
+		total['calls'] += 1
+		total['wall_seconds'] += record['wall_seconds']
+		total['cpu_seconds'] += record['cpu_seconds']
+		total['rows_in'] += record['rows_in'] or 0
+		total['rows_out'] += record['rows_out'] or 0
+	wall = sum(total['wall_seconds'] for total in totals.values()) or 1
+	lines = ['{:<20} {:>6} {:>10} {:>10} {:>6} {:>12} {:>12} {:>12}'.format(
+		'stage', 'calls', 'wall_s', 'cpu_s', 'share', 'rows_in', 'rows_out', 'rows/s')]
+	for name, total in sorted(totals.items(), key=lambda item: -item[1]['wall_seconds']):
+		lines.append('{:<20} {:>6} {:>10.3f} {:>10.3f} {:>5.1f}% {:>12} {:>12} {:>12}'.format(
+			name, total['calls'], total['wall_seconds'], total['cpu_seconds'], 100 * total['wall_seconds'] / wall,
+			total['rows_in'], total['rows_out'],
+			round(total['rows_in'] / total['wall_seconds']) if total['wall_seconds'] else '-'))
+	return '\n'.join(lines)
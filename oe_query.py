@@ -0,0 +1,310 @@
+import hashlib
+import itertools
+import os
+import queue
+import sqlite3
+import threading
+import urllib.parse
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import NamedTuple, Optional, Sequence, Tuple, Union
+import numpy as np
+import pandas as pd
+from config import OE_Constants, DB_PATH
+
+POOL_SIZE = 4
+CACHE_SIZE = 4096
+# series codes bound per matrix query, well under sqlite's variable limit
+MATRIX_CHUNK_SIZE = 500
+
+class SeriesPoint(NamedTuple):
+	year: int
+	value: Optional[float]
+	flag: Optional[str]
+
+class RollupRow(NamedTuple):
+	occupation_code: str
+	name: str
+	year: int
+	value: Optional[float]
+	flag: Optional[str]
+
+class GroupRow(NamedTuple):
+	group_code: str
+	year: int
+	value: Optional[float]
+	members: int
+
+class AreaRow(NamedTuple):
+	code: str
+	name: str
+
+class OccupationRow(NamedTuple):
+	code: str
+	name: str
+	soc_level: int
+
+SERIES_QUERY = """SELECT v.year,v.value,v.flag
+	FROM value v
+	JOIN series_code sc
+	ON sc.code = v.series_code
+	WHERE sc.area_code = ?
+	AND sc.occupation_code = ?
+	AND sc.industry_code = ?
+	AND sc.data_type = ?
+	ORDER BY 1 ASC;"""
+
+ROLLUP_QUERY = """SELECT o.code,o.name,v.year,v.value,v.flag
+	FROM series_code sc
+	JOIN occupation_code o
+	ON o.code = sc.occupation_code
+	JOIN value v
+	ON v.series_code = sc.code
+	WHERE sc.area_code = ?
+	AND sc.industry_code = ?
+	AND sc.data_type = ?
+	AND o.soc_level = ?
+	{year_filter}
+	ORDER BY 1 ASC, 3 ASC;"""
+
+GROUP_QUERY = """SELECT group_code,year,value,members
+	FROM {rollup_table}
+	WHERE area_code = ?
+	AND industry_code = ?
+	AND data_type = ?
+	AND group_type = ?
+	{{year_filter}}
+	ORDER BY 1 ASC, 2 ASC;""".format(rollup_table=OE_Constants.ROLLUP_TABLE)
+
+AREA_SEARCH_QUERY = """SELECT code,name
+	FROM area_code
+	WHERE code LIKE ? OR name LIKE ?
+	ORDER BY 1 ASC;"""
+
+OCCUPATION_SEARCH_QUERY = """SELECT code,name,soc_level
+	FROM occupation_code
+	WHERE (code LIKE ? OR name LIKE ?)
+	{level_filter}
+	ORDER BY 1 ASC;"""
+
+@lru_cache(maxsize=None)
+def matrix_query(num_codes, num_years):
+	year_filter = 'AND v.year IN ({})'.format(','.join('?'*num_years)) if num_years else ''
+	return """SELECT v.series_code,v.year,v.value
+		FROM value v
+		WHERE v.series_code IN ({codes})
+		{year_filter};""".format(codes=','.join('?'*num_codes), year_filter=year_filter)
+
+def code_list(name, codes):
+	# a single code is a str too, which would pass as a list of one-character codes
+	if not isinstance(codes, str):
+		codes = list(codes)
+		if all(isinstance(code, str) for code in codes):
+			return codes
+	raise TypeError('{} must be a list of code strings, not {!r}'.format(name, codes))
+
+class OEDatabase(object):
+	# Read-only access to a built OE.db. Every call compares the file's stat with the one the
+	# pool was opened against, and a rebuilt or re-ingested database reopens the pool and drops
+	# the cached results. A database without a -wal file, such as the snapshot the ingest writes
+	# with --snapshot, is opened with immutable=1, so sqlite skips locking and change detection.
+	# While a -wal file exists a writer may have the database open, and immutable connections
+	# would not see its commits, so the pool reads with the usual locking until it is gone.
+	# The check is a stat before the connect, not a lock: a writer that opens the database
+	# between the two, or a rollback-journal writer that never makes a -wal file, can change
+	# pages under an immutable connection, and until the next call's stat notices and reopens
+	# the pool its reads may be stale or fail as corrupt. Serve snapshots nothing writes to.
+	def __init__(self, path=DB_PATH, pool_size=POOL_SIZE, cache_size=CACHE_SIZE):
+		self.path = os.path.abspath(path)
+		self.pool_size = pool_size
+		self._lock = threading.Lock()
+		self._pool = queue.Queue()
+		self._generation = 0
+		self._opened = 0
+		self._stat = None
+		self._version = None
+		self._cached_query = lru_cache(maxsize=cache_size)(self._query)
+
+	def file_stat(self):
+		# the WAL file holds committed pages that have not been checkpointed yet
+		stat = []
+		for path in (self.path, self.path + '-wal'):
+			try:
+				st = os.stat(path)
+				stat.append((st.st_size, st.st_mtime_ns))
+			except FileNotFoundError:
+				stat.append(None)
+		return tuple(stat)
+
+	def version(self):
+		# identifies the database build; changes whenever the file or its ingest manifest does
+		stat = self.file_stat()
+		if stat != self._stat:
+			with self._lock:
+				if stat != self._stat:
+					self._reset(stat)
+		return self._version
+
+	def _reset(self, stat):
+		self._generation += 1
+		while True:
+			try:
+				self._pool.get_nowait().close()
+			except queue.Empty:
+				break
+			self._opened -= 1
+		self._cached_query.cache_clear()
+		self._stat = stat
+		self._version = hashlib.sha1(repr((stat, self._manifest())).encode()).hexdigest()[:16]
+
+	def _manifest(self):
+		connection = self._connect()
+		try:
+			return connection.execute("""SELECT folder,year,data_type,source_hash FROM {}
+					ORDER BY 1,2,3""".format(OE_Constants.MANIFEST_TABLE)).fetchall()
+		except sqlite3.OperationalError:
+			# built but never ingested
+			return []
+		finally:
+			connection.close()
+
+	def _connect(self):
+		# ?, # and % in the path would otherwise be read as the query, fragment or an escape
+		uri = 'file:{}?mode=ro'.format(urllib.parse.quote(self.path))
+		if self._stat is not None and self._stat[1] is None:
+			uri += '&immutable=1'
+		return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+	@contextmanager
+	def connection(self):
+		self.version()
+		generation = self._generation
+		try:
+			connection = self._pool.get_nowait()
+		except queue.Empty:
+			with self._lock:
+				opened = self._opened < self.pool_size
+				if opened:
+					self._opened += 1
+			connection = self._connect() if opened else self._pool.get()
+		try:
+			yield connection
+		finally:
+			if generation != self._generation:
+				# opened against an older file; its replacement goes to whoever waits for it
+				connection.close()
+				connection = self._connect()
+			self._pool.put(connection)
+
+	def query(self, sql, params=()):
+		# results are cached per database version, so they are returned as tuples to keep them immutable
+		return self._cached_query(self.version(), sql, tuple(params))
+
+	def _query(self, version, sql, params):
+		with self.connection() as connection:
+			return tuple(connection.execute(sql, params).fetchall())
+
+	def get_series(self, area_code: str, occupation_code: str,
+			industry_code: str = OE_Constants.ALL_INDUSTRY_CODE,
+			data_type: str = '01') -> Tuple[SeriesPoint, ...]:
+		rows = self.query(SERIES_QUERY, (area_code, occupation_code, industry_code, data_type))
+		return tuple(SeriesPoint(*row) for row in rows)
+
+	def get_rollup(self, area_code: str, soc_level: Union[int, str],
+			industry_code: str = OE_Constants.ALL_INDUSTRY_CODE,
+			data_type: str = '01', year: Optional[int] = None) -> Tuple[RollupRow, ...]:
+		# soc_level is a number from 0 (all occupations) to 4 (detailed), or its name in OE_Constants.SOC_LEVELS
+		soc_level = OE_Constants.SOC_LEVELS.get(soc_level, soc_level)
+		params = (area_code, industry_code, data_type, soc_level)
+		year_filter = ''
+		if year is not None:
+			year_filter = 'AND v.year = ?'
+			params += (year,)
+		rows = self.query(ROLLUP_QUERY.format(year_filter=year_filter), params)
+		return tuple(RollupRow(*row) for row in rows)
+
+	def get_groups(self, area_code: str, group_type: str,
+			industry_code: str = OE_Constants.ALL_INDUSTRY_CODE,
+			data_type: str = '01', year: Optional[int] = None) -> Tuple[GroupRow, ...]:
+		# precomputed group values; group_type is one of OE_Constants.ROLLUP_GROUP_TYPES and
+		# group_code an occupation code for SOC groups and the group name for occ_group
+		params = (area_code, industry_code, data_type, group_type)
+		year_filter = ''
+		if year is not None:
+			year_filter = 'AND year = ?'
+			params += (year,)
+		rows = self.query(GROUP_QUERY.format(year_filter=year_filter), params)
+		return tuple(GroupRow(*row) for row in rows)
+
+	def search_areas(self, text: str = '') -> Tuple[AreaRow, ...]:
+		pattern = '%{}%'.format(text)
+		return tuple(AreaRow(*row) for row in self.query(AREA_SEARCH_QUERY, (pattern, pattern)))
+
+	def search_occupations(self, text: str = '', soc_level: Optional[Union[int, str]] = None) -> Tuple[OccupationRow, ...]:
+		pattern = '%{}%'.format(text.replace('-', ''))
+		params = (pattern, '%{}%'.format(text))
+		level_filter = ''
+		if soc_level is not None:
+			level_filter = 'AND soc_level = ?'
+			params += (OE_Constants.SOC_LEVELS.get(soc_level, soc_level),)
+		rows = self.query(OCCUPATION_SEARCH_QUERY.format(level_filter=level_filter), params)
+		return tuple(OccupationRow(*row) for row in rows)
+
+	def get_matrix(self, area_codes: Sequence[str], occupation_codes: Sequence[str],
+			industry_code: str = OE_Constants.ALL_INDUSTRY_CODE,
+			data_type: str = '01', years: Optional[Sequence[int]] = None) -> pd.DataFrame:
+		# one row per area and occupation, one column per year (all years found, unless given),
+		# NaN where there is no value; .to_numpy() on the result gives the matrix without a copy.
+		# A repeated code repeats its rows, and each distinct series is fetched once.
+		keys = list(itertools.product(code_list('area_codes', area_codes), code_list('occupation_codes', occupation_codes)))
+		prefix = OE_Constants.SERIES_PREFIX
+		code_ids, codes = pd.factorize(np.array([prefix + area_code + industry_code + occupation_code + data_type
+				for area_code, occupation_code in keys], dtype=object))
+		codes = codes.tolist()
+		year_params = sorted(set(years)) if years is not None else []
+		positions, found_years, values = [], [], []
+		with self.connection() as connection:
+			for start in range(0, len(codes), MATRIX_CHUNK_SIZE):
+				chunk = codes[start:start + MATRIX_CHUNK_SIZE]
+				rows = connection.execute(matrix_query(len(chunk), len(year_params)), chunk + year_params).fetchall()
+				# the rows are converted column-wise in one go, and a NULL value becomes NaN
+				data = pd.DataFrame.from_records(rows, columns=['code', 'year', 'value'])
+				positions.append(start + pd.Index(chunk).get_indexer(data['code']))
+				found_years.append(data['year'].to_numpy(dtype=np.int64))
+				values.append(data['value'].to_numpy(dtype=np.float64))
+		found_years = np.concatenate(found_years) if found_years else np.array([], dtype=np.int64)
+		year_index = np.array(year_params, dtype=np.int64) if years is not None else np.unique(found_years)
+		matrix = np.full((len(codes), len(year_index)), np.nan)
+		if positions:
+			matrix[np.concatenate(positions), np.searchsorted(year_index, found_years)] = np.concatenate(values)
+		matrix = matrix[code_ids]
+		index = pd.MultiIndex.from_tuples(keys, names=['area_code', 'occupation_code'])
+		return pd.DataFrame(matrix, index=index, columns=pd.Index(year_index, name='year'))
+
+_database = None
+_database_lock = threading.Lock()
+
+def get_database():
+	global _database
+	with _database_lock:
+		if _database is None:
+			_database = OEDatabase()
+	return _database
+
+def get_series(area_code, occupation_code, industry_code=OE_Constants.ALL_INDUSTRY_CODE, data_type='01'):
+	return get_database().get_series(area_code, occupation_code, industry_code, data_type)
+
+def get_rollup(area_code, soc_level, industry_code=OE_Constants.ALL_INDUSTRY_CODE, data_type='01', year=None):
+	return get_database().get_rollup(area_code, soc_level, industry_code, data_type, year)
+
+def get_groups(area_code, group_type, industry_code=OE_Constants.ALL_INDUSTRY_CODE, data_type='01', year=None):
+	return get_database().get_groups(area_code, group_type, industry_code, data_type, year)
+
+def search_areas(text=''):
+	return get_database().search_areas(text)
+
+def search_occupations(text='', soc_level=None):
+	return get_database().search_occupations(text, soc_level)
+
+def get_matrix(area_codes, occupation_codes, industry_code=OE_Constants.ALL_INDUSTRY_CODE, data_type='01', years=None):
+	return get_database().get_matrix(area_codes, occupation_codes, industry_code, data_type, years)
@@ -0,0 +1,292 @@
+import argparse
+import asyncio
+import gzip
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs
+from config import OE_Constants, DB_PATH
+from oe_query import OEDatabase, POOL_SIZE
+
+DEFAULT_PORT = 8080
+DEFAULT_PER_PAGE = 100
+MAX_PER_PAGE = 1000
+# smaller bodies are not worth the gzip header and the CPU
+GZIP_MIN_BYTES = 1024
+MAX_HEADER_LINES = 100
+
+class RequestError(Exception):
+	def __init__(self, status, message):
+		super().__init__(message)
+		self.status = status
+
+def get_param(params, name, default=None, required=False):
+	values = params.get(name)
+	if not values:
+		if required:
+			raise RequestError(HTTPStatus.BAD_REQUEST, 'missing parameter: {}'.format(name))
+		return default
+	return values[0]
+
+def get_int_param(params, name, default=None):
+	value = get_param(params, name)
+	if value is None:
+		return default
+	try:
+		return int(value)
+	except ValueError:
+		raise RequestError(HTTPStatus.BAD_REQUEST, 'not a number: {}={}'.format(name, value))
+
+def get_soc_level_param(params, required=False):
+	# a name in OE_Constants.SOC_LEVELS or its number; anything else would match no rows
+	value = get_param(params, 'soc_level', required=required)
+	if value is None or value in OE_Constants.SOC_LEVELS:
+		return value
+	if value.isdigit() and int(value) in OE_Constants.SOC_LEVELS.values():
+		return int(value)
+	raise RequestError(HTTPStatus.BAD_REQUEST, 'soc_level is one of {} or a number from {} to {}'.format(
+			', '.join(OE_Constants.SOC_LEVELS), min(OE_Constants.SOC_LEVELS.values()), max(OE_Constants.SOC_LEVELS.values())))
+
+def paginate(rows, params):
+	page = max(get_int_param(params, 'page', 1), 1)
+	per_page = min(max(get_int_param(params, 'per_page', DEFAULT_PER_PAGE), 1), MAX_PER_PAGE)
+	start = (page - 1) * per_page
+	return {
+		'page': page,
+		'per_page': per_page,
+		'total': len(rows),
+		'items': [row._asdict() for row in rows[start:start + per_page]],
+	}
+
+def series_handler(db, params):
+	rows = db.get_series(
+		get_param(params, 'area', required=True),
+		get_param(params, 'occupation', required=True),
+		get_param(params, 'industry', OE_Constants.ALL_INDUSTRY_CODE),
+		get_param(params, 'data_type', '01'))
+	return {'items': [row._asdict() for row in rows]}
+
+def rollup_handler(db, params):
+	rows = db.get_rollup(
+		get_param(params, 'area', required=True),
+		get_soc_level_param(params, required=True),
+		get_param(params, 'industry', OE_Constants.ALL_INDUSTRY_CODE),
+		get_param(params, 'data_type', '01'),
+		get_int_param(params, 'year'))
+	return paginate(rows, params)
+
+def groups_handler(db, params):
+	group_type = get_param(params, 'group_type', required=True)
+	if group_type not in OE_Constants.ROLLUP_GROUP_TYPES:
+		raise RequestError(HTTPStatus.BAD_REQUEST, 'group_type is one of {}'.format(', '.join(OE_Constants.ROLLUP_GROUP_TYPES)))
+	rows = db.get_groups(
+		get_param(params, 'area', required=True),
+		group_type,
+		get_param(params, 'industry', OE_Constants.ALL_INDUSTRY_CODE),
+		get_param(params, 'data_type', '01'),
+		get_int_param(params, 'year'))
+	return paginate(rows, params)
+
+def areas_handler(db, params):
+	return paginate(db.search_areas(get_param(params, 'q', '')), params)
+
+def occupations_handler(db, params):
+	return paginate(db.search_occupations(get_param(params, 'q', ''), get_soc_level_param(params)), params)
+
+ROUTES = {
+	'/series': series_handler,
+	'/rollup': rollup_handler,
+	'/groups': groups_handler,
+	'/areas': areas_handler,
+	'/occupations': occupations_handler,
+}
+
+class OEServer(object):
+	# HTTP/1.1 with keep-alive on asyncio streams. Lookups run on a thread pool the size of the
+	# connection pool, so the event loop only parses requests and writes responses.
+	def __init__(self, db, workers=POOL_SIZE):
+		self.db = db
+		self.executor = ThreadPoolExecutor(max_workers=workers)
+
+	async def handle_connection(self, reader, writer):
+		try:
+			while True:
+				request = await read_request(reader)
+				if request is None:
+					break
+				method, target, headers = request
+				status, response_headers, body = await self.respond(method, target, headers)
+				keep_alive = headers.get('connection', '').lower() != 'close'
+				write_response(writer, status, response_headers, body, keep_alive, send_body=method != 'HEAD')
+				await writer.drain()
+				if not keep_alive:
+					break
+		except (ConnectionError, asyncio.IncompleteReadError):
+			pass
+		finally:
+			writer.close()
+
+	async def respond(self, method, target, headers):
+		if method not in ('GET', 'HEAD'):
+			return error_response(HTTPStatus.METHOD_NOT_ALLOWED, 'only GET and HEAD')
+		url = urlsplit(target)
+		handler = ROUTES.get(url.path)
+		if handler is None:
+			return error_response(HTTPStatus.NOT_FOUND, 'no such endpoint: {}'.format(url.path))
+		loop = asyncio.get_running_loop()
+		# every response depends only on the url, the database build and its encoding, and
+		# a strong tag differs between encodings
+		version = await loop.run_in_executor(self.executor, self.db.version)
+		gzip_ok = accepts_gzip(headers.get('accept-encoding', ''))
+		response_headers = {'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+		cached = [tag.strip() for tag in headers.get('if-none-match', '').split(',')]
+		for etag in ['"{}-gz"'.format(version)] * gzip_ok + ['"{}"'.format(version)]:
+			if etag in cached:
+				response_headers['ETag'] = etag
+				return HTTPStatus.NOT_MODIFIED, response_headers, b''
+		try:
+			result = await loop.run_in_executor(self.executor, handler, self.db, parse_qs(url.query))
+		except RequestError as e:
+			return error_response(e.status, str(e))
+		except Exception as e:
+			return error_response(HTTPStatus.INTERNAL_SERVER_ERROR, '{}: {}'.format(type(e).__name__, e))
+		body = json.dumps(result).encode()
+		response_headers['Content-Type'] = 'application/json'
+		response_headers['ETag'] = '"{}"'.format(version)
+		if len(body) >= GZIP_MIN_BYTES and gzip_ok:
+			body = gzip.compress(body, compresslevel=5)
+			response_headers['Content-Encoding'] = 'gzip'
+			response_headers['ETag'] = '"{}-gz"'.format(version)
+		return HTTPStatus.OK, response_headers, body
+
+def accepts_gzip(accept_encoding):
+	# gzip is acceptable when listed, or covered by *, with a q value above 0
+	qualities = {}
+	for coding in accept_encoding.split(','):
+		name, _, params = coding.partition(';')
+		quality = 1.0
+		for param in params.split(';'):
+			key, _, value = param.partition('=')
+			if key.strip().lower() == 'q':
+				try:
+					quality = float(value)
+				except ValueError:
+					quality = 0.0
+		qualities[name.strip().lower()] = quality
+	return qualities.get('gzip', qualities.get('x-gzip', qualities.get('*', 0.0))) > 0
+
+async def read_request(reader):
+	request_line = await reader.readline()
+	if not request_line:
+		return None
+	try:
+		method, target, _ = request_line.decode('latin-1').split()
+	except ValueError:
+		raise ConnectionError('malformed request line')
+	headers = {}
+	for _ in range(MAX_HEADER_LINES):
+		line = await reader.readline()
+		if line in (b'\r\n', b'\n', b''):
+			break
+		name, _, value = line.decode('latin-1').partition(':')
+		headers[name.strip().lower()] = value.strip()
+	return method, target, headers
+
+def error_response(status, message):
+	return status, {'Content-Type': 'application/json'}, json.dumps({'error': message}).encode()
+
+def write_response(writer, status, headers, body, keep_alive, send_body=True):
+	# a HEAD response has the headers of the GET, Content-Length included, without its body
+	lines = ['HTTP/1.1 {} {}'.format(status.value, status.phrase)]
+	lines += ['{}: {}'.format(name, value) for name, value in headers.items()]
+	lines.append('Content-Length: {}'.format(len(body)))
+	lines.append('Connection: {}'.format('keep-alive' if keep_alive else 'close'))
+	writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body if send_body else b''))
+
+async def serve(db_path, host, port, workers):
+	server = OEServer(OEDatabase(db_path, pool_size=workers), workers=workers)
+	return await asyncio.start_server(server.handle_connection, host, port)
+
+async def fetch(reader, writer, host, path):
+	writer.write('GET {} HTTP/1.1\r\nHost: {}\r\nAccept-Encoding: gzip\r\n\r\n'.format(path, host).encode())
+	await writer.drain()
+	status_line = await reader.readline()
+	length = 0
+	while True:
+		line = await reader.readline()
+		if line == b'\r\n':
+			break
+		name, _, value = line.decode('latin-1').partition(':')
+		if name.lower() == 'content-length':
+			length = int(value)
+	await reader.readexactly(length)
+	return int(status_line.split()[1])
+
+async def bench(host, port, paths, requests, concurrency):
+	# each client keeps one connection open and works through its share of the requests
+	latencies = []
+	statuses = {}
+	async def client(client_id):
+		reader, writer = await asyncio.open_connection(host, port)
+		for i in range(client_id, requests, concurrency):
+			before = time.perf_counter()
+			status = await fetch(reader, writer, host, paths[i % len(paths)])
+			latencies.append(time.perf_counter() - before)
+			statuses[status] = statuses.get(status, 0) + 1
+		writer.close()
+	before = time.perf_counter()
+	await asyncio.gather(*(client(client_id) for client_id in range(concurrency)))
+	elapsed = time.perf_counter() - before
+	latencies.sort()
+	return {
+		'requests': requests,
+		'concurrency': concurrency,
+		'seconds': round(elapsed, 3),
+		'requests_per_second': round(requests / elapsed, 1),
+		'median_ms': round(statistics.median(latencies) * 1000, 2),
+		'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+		'statuses': statuses,
+	}
+
+def bench_paths(db):
+	# a mix of the endpoints over the areas and major groups actually in the database
+	areas = [row.code for row in db.search_areas()][:50]
+	majors = [row.code for row in db.search_occupations(soc_level='major')]
+	paths = []
+	for i, area in enumerate(areas):
+		occupation = majors[i % len(majors)] if majors else '000000'
+		paths.append('/series?area={}&occupation={}'.format(area, occupation))
+		paths.append('/rollup?area={}&soc_level=major'.format(area))
+	paths.append('/areas?q=CA&per_page=20')
+	paths.append('/occupations?q=engineer')
+	return paths
+
+async def run_bench(db_path, host, port, workers, requests, concurrency):
+	server = await serve(db_path, host, port, workers)
+	async with server:
+		paths = bench_paths(OEDatabase(db_path))
+		return await bench(host, port, paths, requests, concurrency)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Serve OES series, rollups and code searches from the database as JSON')
+	parser.add_argument('--db', default=DB_PATH)
+	parser.add_argument('--host', default='127.0.0.1')
+	parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+	parser.add_argument('--workers', type=int, default=POOL_SIZE,
+						help='threads, and read-only connections, answering lookups')
+	parser.add_argument('--bench', type=int, metavar='REQUESTS',
+						help='start the server, send REQUESTS requests to it, print the timings and exit')
+	parser.add_argument('--concurrency', type=int, default=200,
+						help='concurrent client connections for --bench')
+	args = parser.parse_args()
+	if args.bench:
+		print(json.dumps(asyncio.run(run_bench(args.db, args.host, args.port, args.workers, args.bench, args.concurrency))))
+	else:
+		async def main():
+			server = await serve(args.db, args.host, args.port, args.workers)
+			print('serving {} on http://{}:{}'.format(args.db, args.host, args.port))
+			async with server:
+				await server.serve_forever()
+		asyncio.run(main())
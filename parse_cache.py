@@ -0,0 +1,120 @@
+import argparse
+import hashlib
+import os
+import shutil
+import pyarrow.feather as feather
+from config import CACHE_FOLDER, PARSE_CACHE_MAX_BYTES
+
+# bump when the parsing/normalization in open_df_smart changes, so old entries stop matching
+PARSER_VERSION = '2'
+HASH_CHUNK_SIZE = 1024 * 1024
+CACHE_SUFFIX = '.arrow'
+
+def file_hash(path):
+	# a directory of parquet parts hashes as its part names and contents in order
+	h = hashlib.sha1()
+	if os.path.isdir(path):
+		names = sorted(os.listdir(path))
+	else:
+		names = [None]
+	for name in names:
+		if name is not None:
+			h.update(name.encode())
+		part_path = os.path.join(path, name) if name is not None else path
+		with open(part_path, 'rb') as f:
+			for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+				h.update(chunk)
+	return h.hexdigest()
+
+def cache_prefix(filepath):
+	return os.path.normpath(filepath).replace(os.sep, '_').replace('.', '_') + '-'
+
+def cache_path(filepath, digest, variant=''):
+	# variant distinguishes different parses of the same file, e.g. column subsets
+	variant_hash = hashlib.sha1(variant.encode()).hexdigest()[:8]
+	name = '{}{}-{}-v{}{}'.format(cache_prefix(filepath), digest[:20], variant_hash, PARSER_VERSION, CACHE_SUFFIX)
+	return os.path.join(CACHE_FOLDER, name)
+
+def cached_parse(filepath, parse, digest=None, variant=''):
+	# parquet inputs are already columnar, only workbooks are worth caching
+	if os.path.isdir(filepath):
+		return parse(filepath)
+	digest = digest or file_hash(filepath)
+	path = cache_path(filepath, digest, variant)
+	try:
+		os.utime(path, None)
+		return feather.read_table(path, memory_map=True).to_pandas()
+	except FileNotFoundError:
+		# never cached, or evicted by another process in between: parse again
+		pass
+	df = stringify_mixed_cols( parse(filepath).reset_index(drop=True) )
+	store(filepath, digest, path, df)
+	return df
+
+def store(filepath, digest, path, df):
+	os.makedirs(CACHE_FOLDER, exist_ok=True)
+	invalidate(filepath, keep_digest=digest)
+	tmp_path = path + '.tmp'
+	feather.write_feather(df, tmp_path, compression='uncompressed')
+	os.replace(tmp_path, path)
+	evict()
+
+def cache_entries():
+	if not os.path.isdir(CACHE_FOLDER):
+		return []
+	return [os.path.join(CACHE_FOLDER, f) for f in os.listdir(CACHE_FOLDER) if f.endswith(CACHE_SUFFIX)]
+
+def invalidate(filepath, keep_digest=None):
+	# drops entries for older versions of the file; keep_digest spares the current one
+	prefix = cache_prefix(filepath)
+	keep_prefix = prefix + keep_digest[:20] if keep_digest else None
+	for path in cache_entries():
+		name = os.path.basename(path)
+		if name.startswith(prefix) and not (keep_prefix and name.startswith(keep_prefix)):
+			remove_entry(path)
+
+def remove_entry(path):
+	# other processes share the cache and may have removed the entry already
+	try:
+		os.remove(path)
+	except FileNotFoundError:
+		pass
+
+def evict(max_bytes=PARSE_CACHE_MAX_BYTES):
+	# least recently used first; hits touch the entry's mtime
+	entries = []
+	for path in cache_entries():
+		try:
+			stat = os.stat(path)
+		except FileNotFoundError:
+			continue
+		entries.append((stat.st_mtime, stat.st_size, path))
+	entries.sort()
+	total = sum(size for _, size, _ in entries)
+	for _, size, path in entries:
+		if total <= max_bytes:
+			break
+		total -= size
+		remove_entry(path)
+
+def clear():
+	if os.path.isdir(CACHE_FOLDER):
+		shutil.rmtree(CACHE_FOLDER)
+
+def stringify_mixed_cols(df):
+	# arrow needs one type per column; footnote markers like '*' mix text into numeric columns
+	for col in df.columns[df.dtypes == object]:
+		values = df[col].dropna()
+		if len(set(map(type, values))) > 1:
+			df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+	return df
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Manage the parsed workbook cache')
+	parser.add_argument('--clear', action='store_true', help='remove every cached entry')
+	parser.add_argument('--evict', action='store_true', help='trim the cache to PARSE_CACHE_MAX_BYTES')
+	args = parser.parse_args()
+	if args.clear:
+		clear()
+	elif args.evict:
+		evict()
@@ -21,3 +21,13 @@ where sc.area_code='M0048140'
 and sc.industry_code='000000'
 and sc.occupation_code like '__0000'
 order by 1 asc, 2 asc;
+
+
+SELECT o.name,r.year,r.value FROM occ_rollup r
+join occupation_code o
+on o.code = r.group_code
+where r.area_code='M0048140'
+and r.industry_code='000000'
+and r.data_type='01'
+and r.group_type='major'
+order by 1 asc, 2 asc;
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the modules read their code files relative to the working directory, and the ingest
+# connects to OE_DB_PATH when it is imported, so it gets a scratch database
+os.chdir(REPO)
+sys.path.insert(0, REPO)
+os.environ['OE_DB_PATH'] = os.path.join(tempfile.mkdtemp(prefix='oe_tests_'), 'OE.db')
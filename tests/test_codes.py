@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+import pytest
+import get_OE_data_from_xlsx as ingest
+from config import FULL_FOLDER, NAT_FOLDER, STATE_FOLDER, METRO_FOLDER
+
+NAICS = ['000000', 0, '11', '21', '31-33', '44-45', '48-49', '541100', '999200', '000001']
+
+def synthetic_codes(n=2000, seed=0):
+	# every AREA_TYPE, areas of every width, and NAICS codes in each of the forms the files use
+	rng = np.random.default_rng(seed)
+	return pd.DataFrame({
+		'AREA': rng.choice([1, 6, 12, 56, 72, 10180, 35620, 70750, 1234567], n),
+		'AREA_TYPE': rng.integers(1, 7, n),
+		'NAICS': rng.choice(np.array(NAICS, dtype=object), n),
+	})
+
+@pytest.mark.parametrize('foldername', [NAT_FOLDER, STATE_FOLDER, FULL_FOLDER, METRO_FOLDER])
+def test_area_codes_match_row_wise(foldername):
+	df = synthetic_codes()
+	expected = df.apply(ingest.get_area_code_enclosure('2019', foldername), axis=1)
+	assert list(np.asarray(ingest.get_area_codes(df, foldername), dtype=object)) == list(expected)
+
+def test_industry_codes_match_row_wise():
+	df = synthetic_codes()
+	expected = df['NAICS'].map(ingest.interpret_industry_code)
+	assert list(np.asarray(ingest.get_industry_codes(df['NAICS']), dtype=object)) == list(expected)
+
+def test_unexpected_area_type_is_an_error():
+	df = synthetic_codes(10)
+	df.loc[3, 'AREA_TYPE'] = 9
+	with pytest.raises(ValueError):
+		ingest.get_area_codes(df, FULL_FOLDER)
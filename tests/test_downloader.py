@@ -0,0 +1,107 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+from downloader import Downloader, DownloadJob, PART_SUFFIX, META_SUFFIX, read_meta, write_meta
+
+BODY = bytes(range(256)) * 64
+
+class Handler(BaseHTTPRequestHandler):
+	# one file with an ETag, answering If-None-Match with 304 and Range with 206 while If-Range matches
+	def do_GET(self):
+		server = self.server
+		server.requests.append(dict(self.headers))
+		body, etag = server.body, server.etag
+		if self.headers.get('If-None-Match') == etag:
+			self.send_response(304)
+			self.send_header('ETag', etag)
+			self.end_headers()
+			return
+		start = 0
+		if self.headers.get('Range') and self.headers.get('If-Range', etag) == etag:
+			start = int(self.headers['Range'][len('bytes='):].rstrip('-'))
+			self.send_response(206)
+			self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, len(body) - 1, len(body)))
+		else:
+			self.send_response(200)
+		self.send_header('ETag', etag)
+		self.send_header('Content-Length', str(len(body) - start))
+		self.end_headers()
+		if not server.drop_body:
+			self.wfile.write(body[start:])
+
+	def log_message(self, *args):
+		pass
+
+@pytest.fixture
+def server():
+	httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+	httpd.requests, httpd.body, httpd.etag, httpd.drop_body = [], BODY, '"v1"', False
+	thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+	thread.start()
+	yield httpd
+	httpd.shutdown()
+	httpd.server_close()
+
+@pytest.fixture
+def job(server, tmp_path):
+	return DownloadJob(url='http://127.0.0.1:{}/oesm.zip'.format(server.server_address[1]), dest_path=str(tmp_path / 'oesm.zip'))
+
+def read(path):
+	with open(path, 'rb') as f:
+		return f.read()
+
+def download(job):
+	return Downloader(workers=1, min_interval=0).download(job)
+
+def test_download_then_not_modified(server, job):
+	result = download(job)
+	assert result.changed and result.bytes_written == len(BODY)
+	assert read(job.dest_path) == BODY
+	assert read_meta(job.dest_path)['etag'] == '"v1"'
+	assert not os.path.exists(job.dest_path + PART_SUFFIX)
+	assert not os.path.exists(job.dest_path + PART_SUFFIX + META_SUFFIX)
+	result = download(job)
+	assert not result.changed
+	assert server.requests[-1]['If-None-Match'] == '"v1"'
+
+def test_changed_etag_downloads_again(server, job):
+	download(job)
+	server.body, server.etag = BODY[::-1], '"v2"'
+	result = download(job)
+	assert result.changed
+	assert read(job.dest_path) == BODY[::-1]
+	assert read_meta(job.dest_path)['etag'] == '"v2"'
+
+def test_resumes_a_partial_download(server, job):
+	part_path = job.dest_path + PART_SUFFIX
+	with open(part_path, 'wb') as f:
+		f.write(BODY[:1000])
+	write_meta(part_path, {'etag': '"v1"', 'size': str(len(BODY))})
+	result = download(job)
+	assert server.requests[-1]['Range'] == 'bytes=1000-'
+	assert server.requests[-1]['If-Range'] == '"v1"'
+	assert result.bytes_written == len(BODY) - 1000
+	assert read(job.dest_path) == BODY
+	assert not os.path.exists(part_path) and not os.path.exists(part_path + META_SUFFIX)
+
+def test_partial_download_of_an_older_version_starts_over(server, job):
+	part_path = job.dest_path + PART_SUFFIX
+	with open(part_path, 'wb') as f:
+		f.write(b'x' * 1000)
+	write_meta(part_path, {'etag': '"v0"', 'size': str(len(BODY))})
+	result = download(job)
+	assert result.bytes_written == len(BODY)
+	assert read(job.dest_path) == BODY
+
+def test_interrupt_before_any_data_leaves_nothing_to_resume(server, job):
+	server.drop_body = True
+	with pytest.raises(requests.RequestException):
+		download(job)
+	assert not read_meta(job.dest_path + PART_SUFFIX)
+	server.drop_body = False
+	result = download(job)
+	assert 'Range' not in server.requests[-1]
+	assert result.bytes_written == len(BODY)
+	assert read(job.dest_path) == BODY
@@ -0,0 +1,37 @@
+from concurrent.futures import ProcessPoolExecutor
+import instrumentation
+
+def traced_stage():
+	with instrumentation.stage('work') as record:
+		record.out(list(range(1000)))
+	return instrumentation.settings(), instrumentation.drain()
+
+def test_workers_inherit_settings(tmp_path):
+	before = instrumentation.settings()
+	try:
+		instrumentation.configure(jsonl_path=str(tmp_path / 'stages.jsonl'), echo=False,
+			profile_stages=['open'], trace_memory_stages=[instrumentation.ALL_STAGES], profile_dir=str(tmp_path))
+		with ProcessPoolExecutor(max_workers=1, initializer=instrumentation.configure_worker,
+				initargs=(instrumentation.settings(),)) as executor:
+			settings, records = executor.submit(traced_stage).result()
+	finally:
+		instrumentation.configure(**before)
+	assert settings['jsonl_path'] is None
+	assert settings['profile_stages'] == ('open',)
+	assert settings['trace_memory_stages'] == (instrumentation.ALL_STAGES,)
+	assert settings['profile_dir'] == str(tmp_path)
+	assert not settings['echo']
+	assert records[0]['rows_out'] == 1000
+	assert 'peak_traced_mb' in records[0]
+
+def test_quiet_silences_progress_lines(capsys):
+	before = instrumentation.settings()
+	try:
+		instrumentation.configure(echo=False)
+		instrumentation.echo('folder', 'nat')
+		assert capsys.readouterr().out == ''
+		instrumentation.configure(echo=True)
+		instrumentation.echo('folder', 'nat')
+		assert capsys.readouterr().out == 'folder nat\n'
+	finally:
+		instrumentation.configure(**before)
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+import pytest
+import benchmark_OE
+import build_database_OE
+import get_OE_data_from_xlsx as ingest
+from config import (CONSTANTS, OE_Constants, DATA_CODE_AGG_FUNCS, SOC_GROUP_LEVELS, VALUE_FLAGS, WEIGHT_DATA_CODE,
+	aggregate_measures, apply_degrouping_transformations, apply_occ_transformations, sum_groups_df)
+
+_column_heads = CONSTANTS.column_heads
+
+# The series codes as object strings, the way the pipeline built them before it carried categoricals:
+# reference_long is the old generate_series_codes and melt_measures, reference_sum_groups the old sum_groups_df.
+
+def reference_long(df, data_type_codes):
+	df = df.astype({column: object for column in df.columns if isinstance(df[column].dtype, pd.CategoricalDtype)})
+	df['OCCUPATION_CODE'] = df[_column_heads['other_codes']['occupation_code']].apply(ingest.rem_hyphen)
+	df['SERIES_CODE'] = OE_Constants.SERIES_PREFIX + df.AREA_CODE + df.INDUSTRY_CODE + df.OCCUPATION_CODE
+	heads = {_column_heads['data_codes'][code]: code for code in data_type_codes}
+	weight_head = _column_heads['data_codes'][WEIGHT_DATA_CODE]
+	id_df = df[['SERIES_CODE', 'OCC_CODE']].assign(WEIGHT=df[weight_head] if weight_head in df.columns else np.nan)
+	long_df = pd.concat([id_df, df[[head for head in heads if head in df.columns]]], axis=1).melt(
+		id_vars=['SERIES_CODE', 'OCC_CODE', 'WEIGHT'], var_name='DATA_HEAD', value_name='VALUE')
+	long_df['DATA_TYPE'] = long_df['DATA_HEAD'].map(heads)
+	long_df['SERIES_CODE'] = long_df['SERIES_CODE'] + long_df['DATA_TYPE']
+	flags = [df[head + ingest.FLAG_SUFFIX].to_numpy(dtype=object) for head in heads if head in df.columns]
+	long_df['FLAG'] = pd.Categorical(np.concatenate(flags) if flags else [], categories=VALUE_FLAGS)
+	return long_df.drop(columns='DATA_HEAD')
+
+def reference_sum_groups(df):
+	rolled_up = [code for code, agg_func in DATA_CODE_AGG_FUNCS.items() if agg_func is not None]
+	detailed = df.loc[~df["OCC_CODE"].str.endswith("0") & df["DATA_TYPE"].isin(rolled_up), ["SERIES_CODE", "VALUE", "WEIGHT"]]
+	series_codes = detailed["SERIES_CODE"]
+	occ_ids, occ_uniques = pd.factorize(series_codes.str.slice(17, 23))
+	stem_ids, stem_uniques = pd.factorize(series_codes.str.slice(stop=17) + series_codes.str.slice(start=23))
+	occ_uniques = pd.Series(occ_uniques, dtype=object)
+	group_ids, group_uniques = pd.factorize(pd.concat(
+		[occ_uniques.str.slice(stop=6-num_zeros) + "0"*num_zeros for num_zeros in SOC_GROUP_LEVELS],
+		ignore_index=True))
+	stems, groups, values, weights = [], [], [], []
+	for level, num_zeros in enumerate(SOC_GROUP_LEVELS):
+		keep = np.ones(len(occ_uniques), dtype=bool)
+		if num_zeros != SOC_GROUP_LEVELS[-1]:
+			keep = (occ_uniques.str.get(5-num_zeros) != "0").to_numpy()
+		rows = keep[occ_ids]
+		stems.append(stem_ids[rows])
+		groups.append(group_ids[level*len(occ_uniques) + occ_ids[rows]])
+		values.append(detailed["VALUE"].to_numpy()[rows])
+		weights.append(detailed["WEIGHT"].to_numpy()[rows])
+	stems = np.concatenate(stems)
+	stem_data_types = pd.Series(np.asarray(stem_uniques, dtype=object)).str.slice(start=-2).to_numpy()
+	group_df = pd.DataFrame({
+		"stem": stems,
+		"group": np.concatenate(groups),
+		"DATA_TYPE": stem_data_types[stems],
+		"VALUE": np.concatenate(values),
+		"WEIGHT": np.concatenate(weights),
+	})
+	group_values = aggregate_measures(group_df, ["stem", "group", "DATA_TYPE"])
+	if group_values.empty:
+		return df
+	group_stems = pd.Series(np.asarray(stem_uniques, dtype=object)[group_values.index.get_level_values("stem")])
+	group_occ = np.asarray(group_uniques, dtype=object)[group_values.index.get_level_values("group")]
+	group_codes = group_stems.str.slice(stop=17) + group_occ + group_stems.str.slice(start=17)
+	positions = pd.Index(group_codes).get_indexer(df["SERIES_CODE"])
+	group_values = group_values.to_numpy()[positions]
+	computed = (positions >= 0) & ~np.isnan(group_values)
+	df["VALUE"] = np.where(computed, group_values, df["VALUE"])
+	df["FLAG"] = df["FLAG"].where(~computed)
+	return df
+
+def reference_rows(long_df):
+	# what the old insert_data wrote: code -> (value, flag)
+	keys = ['SERIES_CODE', 'DATA_TYPE']
+	values = aggregate_measures(long_df, keys)
+	suppressed = long_df[long_df.VALUE.isna() & long_df.FLAG.notna()]
+	flags = suppressed.groupby(keys, sort=False, observed=True)['FLAG'].first().reindex(values.index)
+	agg_df = pd.DataFrame({'value': values, 'flag': flags.where(values.isna())}).reset_index()
+	agg_df = agg_df[agg_df.value.notna() | agg_df.flag.notna()]
+	return dict(zip(agg_df['SERIES_CODE'], zip(agg_df['value'], agg_df['flag'].astype(object).where(agg_df['flag'].notna(), None))))
+
+def wide_frame(raw, year, foldername):
+	# the steps of transform_file before the series codes
+	df = ingest.generate_basic_codes(raw.copy(), year, foldername)
+	for data_type_code in set(ingest.INGEST_DATA_TYPES) | {WEIGHT_DATA_CODE}:
+		df = ingest.numerify_data_col(df, data_type_code)
+	df = ingest.deduplicate_df(apply_degrouping_transformations(df, year))
+	return apply_occ_transformations(df, year)
+
+# areas of the state files kept, for speed
+MAX_AREAS = 6
+
+@pytest.fixture(scope='module')
+def value_table():
+	build_database_OE.create_value_table(ingest._conn)
+	return ingest._conn
+
+# the synthetic files footnote TOT_EMP and A_PCT90 only, so measure 03 (H_MEAN) has no flagged cell
+@pytest.mark.parametrize('scale,soc,data_type_codes', [
+	('national', 'soc2000', ingest.INGEST_DATA_TYPES),
+	('state', 'soc2000', ingest.INGEST_DATA_TYPES),
+	('state', 'soc2010', ingest.INGEST_DATA_TYPES),
+	('national', 'soc2018', ingest.INGEST_DATA_TYPES),
+	('national', 'soc2018', ['03']),
+	('state', 'soc2010', ['03']),
+])
+def test_matches_string_pipeline(value_table, scale, soc, data_type_codes):
+	year = benchmark_OE.SOC_YEARS[soc]
+	raw = benchmark_OE.synthetic_frame(scale, soc)
+	raw = raw[raw['AREA'].isin(raw['AREA'].unique()[:MAX_AREAS])].reset_index(drop=True)
+	df = wide_frame(raw, year, benchmark_OE.SCALES[scale][0])
+	expected = reference_rows(reference_sum_groups(reference_long(df.copy(), data_type_codes)))
+	long_df = ingest.melt_measures(ingest.generate_series_codes(df.copy()), data_type_codes)
+	with value_table:
+		value_table.execute("""DELETE FROM {}""".format(OE_Constants.VALUE_TABLE))
+		ingest.insert_data(sum_groups_df(long_df), year)
+	rows = value_table.execute("""SELECT series_code,value,flag FROM {}""".format(OE_Constants.VALUE_TABLE)).fetchall()
+	actual = {code: (np.nan if value is None else value, flag) for code, value, flag in rows}
+	assert sorted(actual) == sorted(expected)
+	assert [actual[code][1] for code in sorted(actual)] == [expected[code][1] for code in sorted(actual)]
+	assert [actual[code][0] for code in sorted(actual)] == pytest.approx(
+		[expected[code][0] for code in sorted(actual)], rel=1e-9, nan_ok=True)
@@ -0,0 +1,82 @@
+import os
+import pandas as pd
+import pytest
+import parse_cache
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+	monkeypatch.setattr(parse_cache, 'CACHE_FOLDER', str(tmp_path / 'cache'))
+	return tmp_path
+
+def write_source(path, text):
+	with open(path, 'w') as f:
+		f.write(text)
+
+class Parser(object):
+	def __init__(self):
+		self.calls = 0
+
+	def __call__(self, path):
+		self.calls += 1
+		with open(path) as f:
+			return pd.DataFrame({'text': [f.read()], 'value': [1.5]})
+
+def test_hit_reads_the_stored_parse(cache):
+	source = str(cache / 'source.xlsx')
+	write_source(source, 'a')
+	parse = Parser()
+	first = parse_cache.cached_parse(source, parse)
+	second = parse_cache.cached_parse(source, parse)
+	assert parse.calls == 1
+	pd.testing.assert_frame_equal(first, second)
+
+def test_changed_file_is_a_miss(cache):
+	source = str(cache / 'source.xlsx')
+	write_source(source, 'a')
+	parse = Parser()
+	parse_cache.cached_parse(source, parse)
+	write_source(source, 'b')
+	assert parse_cache.cached_parse(source, parse).text.tolist() == ['b']
+	assert parse.calls == 2
+	# the entry of the old contents is dropped
+	assert len(parse_cache.cache_entries()) == 1
+
+def test_entry_removed_while_loading_is_a_miss(cache, monkeypatch):
+	source = str(cache / 'source.xlsx')
+	write_source(source, 'a')
+	parse = Parser()
+	parse_cache.cached_parse(source, parse)
+	def evicted(path, memory_map):
+		raise FileNotFoundError(path)
+	monkeypatch.setattr(parse_cache.feather, 'read_table', evicted)
+	assert parse_cache.cached_parse(source, parse).text.tolist() == ['a']
+	assert parse.calls == 2
+
+def test_evict_drops_least_recently_used(cache):
+	parse = Parser()
+	sources = [str(cache / '{}.xlsx'.format(name)) for name in 'abc']
+	for mtime, source in enumerate(sources):
+		write_source(source, source)
+		parse_cache.cached_parse(source, parse)
+		os.utime(parse_cache.cache_path(source, parse_cache.file_hash(source)), (mtime, mtime))
+	# a hit makes the oldest entry the most recently used, so b is the one to go
+	parse_cache.cached_parse(sources[0], parse)
+	size = max(os.path.getsize(path) for path in parse_cache.cache_entries())
+	parse_cache.evict(max_bytes=2 * size)
+	parse_cache.cached_parse(sources[0], parse)
+	parse_cache.cached_parse(sources[2], parse)
+	assert parse.calls == 3
+	parse_cache.cached_parse(sources[1], parse)
+	assert parse.calls == 4
+
+def test_evict_ignores_entries_removed_meanwhile(cache, monkeypatch):
+	parse = Parser()
+	for name in 'ab':
+		source = str(cache / '{}.xlsx'.format(name))
+		write_source(source, name)
+		parse_cache.cached_parse(source, parse)
+	entries = parse_cache.cache_entries()
+	monkeypatch.setattr(parse_cache, 'cache_entries', lambda: entries + [entries[0] + '.gone'])
+	os.remove(entries[1])
+	parse_cache.evict(max_bytes=0)
+	assert not os.path.exists(entries[0])
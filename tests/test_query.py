@@ -0,0 +1,66 @@
+import os
+import sqlite3
+import numpy as np
+import pytest
+from config import OE_Constants
+from oe_query import OEDatabase
+
+AREA, OCCUPATION, INDUSTRY, DATA_TYPE = 'N0000000', '110000', OE_Constants.ALL_INDUSTRY_CODE, '01'
+SERIES_CODE = OE_Constants.SERIES_PREFIX + AREA + INDUSTRY + OCCUPATION + DATA_TYPE
+
+@pytest.fixture
+def db_path(tmp_path):
+	path = str(tmp_path / 'OE.db')
+	conn = sqlite3.connect(path)
+	conn.execute("""CREATE TABLE series_code (code text primary key, occupation_code text, industry_code text,
+		area_code text, data_type text, complete boolean, exist boolean)""")
+	conn.execute("""CREATE TABLE value (series_code text, year integer, period text, data_date date,
+		value real, flag text, primary key(series_code,data_date))""")
+	conn.execute("""INSERT INTO series_code VALUES (?,?,?,?,?,1,1)""", (SERIES_CODE, OCCUPATION, INDUSTRY, AREA, DATA_TYPE))
+	conn.executemany("""INSERT INTO value VALUES (?,?,'A01',?,?,NULL)""",
+		[(SERIES_CODE, year, '{}-01-01'.format(year), 100.0) for year in (2019, 2020)])
+	conn.commit()
+	conn.close()
+	return path
+
+def test_sees_commits_of_an_open_writer(db_path):
+	writer = sqlite3.connect(db_path)
+	writer.execute('PRAGMA journal_mode=WAL')
+	db = OEDatabase(db_path)
+	assert [point.value for point in db.get_series(AREA, OCCUPATION)] == [100.0, 100.0]
+	with writer:
+		writer.execute("""UPDATE value SET value = 200.0 WHERE year = 2020""")
+	assert [point.value for point in db.get_series(AREA, OCCUPATION)] == [100.0, 200.0]
+	writer.close()
+	assert [point.value for point in db.get_series(AREA, OCCUPATION)] == [100.0, 200.0]
+
+def test_snapshot_is_read_immutable(db_path):
+	db = OEDatabase(db_path)
+	assert len(db.get_series(AREA, OCCUPATION)) == 2
+	with db.connection() as connection:
+		# an immutable connection takes no locks, so it reads while another holds an exclusive one
+		locker = sqlite3.connect(db_path)
+		locker.execute('BEGIN EXCLUSIVE')
+		assert connection.execute('SELECT count(*) FROM value').fetchone() == (2,)
+		locker.rollback()
+		locker.close()
+
+def test_matrix_repeats_rows_of_repeated_codes(db_path):
+	db = OEDatabase(db_path)
+	matrix = db.get_matrix([AREA, AREA], iter([OCCUPATION, '000000']), years=[2020, 2019, 2020])
+	assert list(matrix.index) == [(AREA, OCCUPATION), (AREA, '000000')] * 2
+	assert list(matrix.columns) == [2019, 2020]
+	assert matrix.to_numpy()[[0, 2]].tolist() == [[100.0, 100.0]] * 2
+	assert np.isnan(matrix.to_numpy()[[1, 3]]).all()
+
+@pytest.mark.parametrize('area_codes', [AREA, [AREA, None]])
+def test_matrix_rejects_what_is_not_a_list_of_codes(db_path, area_codes):
+	with pytest.raises(TypeError):
+		OEDatabase(db_path).get_matrix(area_codes, [OCCUPATION])
+
+def test_path_with_uri_characters(tmp_path, db_path):
+	directory = tmp_path / 'a?b#c%20d'
+	directory.mkdir()
+	path = str(directory / 'OE.db')
+	os.rename(db_path, path)
+	assert len(OEDatabase(path).get_series(AREA, OCCUPATION)) == 2
@@ -0,0 +1,9 @@
+import check_query_plans
+
+def test_canonical_queries_use_indexes(tmp_path):
+	# the fully populated database of check_query_plans.py --synthetic, with one year to keep it quick
+	conn = check_query_plans.build_synthetic_db(str(tmp_path / 'synthetic.db'), [2019])
+	try:
+		assert check_query_plans.check_queries(conn, repeat=1) == []
+	finally:
+		conn.close()
@@ -0,0 +1,89 @@
+import asyncio
+import gzip
+import json
+from collections import namedtuple
+from http import HTTPStatus
+import pytest
+from oe_server import OEServer, accepts_gzip, write_response, GZIP_MIN_BYTES
+
+Row = namedtuple('Row', ['code', 'title'])
+
+class FakeDatabase(object):
+	# the lookups the handlers make, with a body large enough to be compressed
+	def __init__(self):
+		self.calls = []
+
+	def version(self):
+		return 'v1'
+
+	def get_rollup(self, area_code, soc_level, industry_code, data_type, year):
+		self.calls.append(soc_level)
+		return (Row('110000', 'x' * GZIP_MIN_BYTES),)
+
+	def search_occupations(self, text='', soc_level=None):
+		self.calls.append(soc_level)
+		return (Row('110000', 'x' * GZIP_MIN_BYTES),)
+
+class Writer(object):
+	def __init__(self):
+		self.data = b''
+
+	def write(self, data):
+		self.data += data
+
+def respond(db, target, **headers):
+	return asyncio.run(OEServer(db, workers=1).respond('GET', target, headers))
+
+@pytest.mark.parametrize('header, expected', [
+	('gzip', True),
+	('deflate, gzip;q=0.5', True),
+	('gzip;q=0', False),
+	('gzip; q=0.0, deflate', False),
+	('*', True),
+	('*;q=0', False),
+	('identity', False),
+	('', False),
+])
+def test_accepts_gzip(header, expected):
+	assert accepts_gzip(header) == expected
+
+def test_etag_depends_on_the_encoding():
+	db = FakeDatabase()
+	status, identity_headers, body = respond(db, '/rollup?area=N0000000&soc_level=major', **{'accept-encoding': 'gzip;q=0'})
+	assert status == HTTPStatus.OK and 'Content-Encoding' not in identity_headers
+	status, gzip_headers, gzip_body = respond(db, '/rollup?area=N0000000&soc_level=major', **{'accept-encoding': 'gzip'})
+	assert gzip_headers['Content-Encoding'] == 'gzip' and gzip.decompress(gzip_body) == body
+	assert identity_headers['ETag'] != gzip_headers['ETag']
+	status, headers, _ = respond(db, '/rollup?area=N0000000&soc_level=major',
+		**{'accept-encoding': 'gzip', 'if-none-match': gzip_headers['ETag']})
+	assert status == HTTPStatus.NOT_MODIFIED and headers['ETag'] == gzip_headers['ETag']
+	# a client that refuses gzip does not revalidate the gzip body
+	status, _, _ = respond(db, '/rollup?area=N0000000&soc_level=major',
+		**{'accept-encoding': 'identity', 'if-none-match': gzip_headers['ETag']})
+	assert status == HTTPStatus.OK
+
+def test_head_has_the_length_of_get():
+	writer = Writer()
+	write_response(writer, HTTPStatus.OK, {}, b'{"items": []}', True, send_body=False)
+	head, _, body = writer.data.partition(b'\r\n\r\n')
+	assert b'Content-Length: 13' in head.split(b'\r\n')
+	assert body == b''
+
+@pytest.mark.parametrize('path', ['/rollup?area=N0000000&', '/occupations?'])
+@pytest.mark.parametrize('soc_level, expected', [('major', 'major'), ('4', 4), ('0', 0)])
+def test_soc_level_names_and_numbers(path, soc_level, expected):
+	db = FakeDatabase()
+	status, _, _ = respond(db, path + 'soc_level=' + soc_level)
+	assert status == HTTPStatus.OK and db.calls == [expected]
+
+@pytest.mark.parametrize('path', ['/rollup?area=N0000000&', '/occupations?'])
+@pytest.mark.parametrize('soc_level', ['majr', '5', '-1', ''])
+def test_unknown_soc_level_is_a_bad_request(path, soc_level):
+	db = FakeDatabase()
+	status, _, body = respond(db, path + 'soc_level=' + soc_level)
+	if soc_level == '' and path.startswith('/occupations'):
+		# an empty parameter is no parameter, and searches every level
+		assert status == HTTPStatus.OK and db.calls == [None]
+	else:
+		assert status == HTTPStatus.BAD_REQUEST and 'soc_level' in json.loads(body)['error']
+		assert db.calls == []
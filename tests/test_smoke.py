@@ -0,0 +1,107 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import pytest
+import benchmark_OE
+import build_database_OE
+from config import DATA_FOLDER, FULL_FOLDER, NAT_FOLDER, STATE_FOLDER, METRO_FOLDER
+from conftest import REPO
+
+# what the scripts read from the working directory
+SOURCES = ['OE', 'group_names.csv', 'soc_2000_to_2010_crosswalk.xls', 'soc_2010_to_2018_crosswalk.xlsx',
+	'soc_2000_to_2010_crosswalk.json', 'soc_2010_to_2018_crosswalk.json']
+
+def make_workdir(path, df):
+	# df as the national file of its year, so with SOC 2000 codes the 2000 -> 2010 -> 2018 crosswalks all apply
+	for name in SOURCES:
+		os.symlink(os.path.join(REPO, name), str(path / name))
+	for folder in [FULL_FOLDER, NAT_FOLDER, STATE_FOLDER, METRO_FOLDER]:
+		os.makedirs(str(path / DATA_FOLDER / folder))
+	source = str(path / DATA_FOLDER / NAT_FOLDER / '{}.xlsx'.format(benchmark_OE.SOC_YEARS['soc2000']))
+	df.to_excel(source, index=False)
+	return source
+
+@pytest.fixture(scope='module')
+def workdir(tmp_path_factory):
+	path = tmp_path_factory.mktemp('smoke')
+	make_workdir(path, benchmark_OE.synthetic_frame('national', 'soc2000'))
+	return path
+
+def run_script(workdir, db_path, script, *args):
+	subprocess.run([sys.executable, os.path.join(REPO, script)] + list(args), cwd=str(workdir), check=True,
+		stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, env=dict(os.environ, OE_DB_PATH=db_path))
+
+def ingest(workdir, name, build_args, ingest_args):
+	db_path = str(workdir / name)
+	run_script(workdir, db_path, 'build_database_OE.py', *build_args)
+	run_script(workdir, db_path, 'get_OE_data_from_xlsx.py', '--quiet', *ingest_args)
+	conn = sqlite3.connect(db_path)
+	rows = conn.execute("""SELECT series_code,year,value,flag FROM value ORDER BY 1,2""").fetchall()
+	conn.close()
+	return rows
+
+@pytest.fixture(scope='module')
+def standard_rows(workdir):
+	return ingest(workdir, 'standard.db', [], [])
+
+def test_series_codes_are_well_formed(standard_rows):
+	assert standard_rows
+	assert {len(row[0]) for row in standard_rows} == {25}
+	assert not [row for row in standard_rows if ' ' in row[0]]
+
+@pytest.mark.parametrize('ingest_args', [[], ['--stream', '--chunk-rows', '97'], ['--build']])
+def test_compact_schema_matches_standard(workdir, standard_rows, ingest_args):
+	rows = ingest(workdir, 'compact{}.db'.format(len(ingest_args)), ['--compact'], ingest_args)
+	assert [row[0:2] + row[3:] for row in rows] == [row[0:2] + row[3:] for row in standard_rows]
+	assert [row[2] for row in rows] == pytest.approx([row[2] for row in standard_rows], nan_ok=True)
+
+def rollup_rows(db_path):
+	conn = sqlite3.connect(db_path)
+	rows = conn.execute("""SELECT * FROM occ_rollup ORDER BY 1,2,3,4,5,6""").fetchall()
+	conn.close()
+	return rows
+
+@pytest.mark.parametrize('ingest_args', [[], ['--stream', '--chunk-rows', '97']])
+def test_file_rollups_match_a_full_refresh(workdir, ingest_args):
+	# each file writes the group rows of its own series; --refresh-rollups recomputes them from value
+	name = 'rollup{}.db'.format(len(ingest_args))
+	ingest(workdir, name, [], ingest_args)
+	per_file = rollup_rows(str(workdir / name))
+	run_script(workdir, str(workdir / name), 'get_OE_data_from_xlsx.py', '--quiet', '--refresh-rollups')
+	refreshed = rollup_rows(str(workdir / name))
+	assert per_file
+	assert [row[:6] + row[7:] for row in per_file] == [row[:6] + row[7:] for row in refreshed]
+	assert [row[6] for row in per_file] == pytest.approx([row[6] for row in refreshed], rel=1e-9, nan_ok=True)
+
+@pytest.mark.parametrize('ingest_args', [[], ['--stream', '--chunk-rows', '97']])
+def test_reingest_drops_groups_the_file_no_longer_has(tmp_path, ingest_args):
+	# the file's new series replace its group rows, so groups it no longer has go too
+	df = benchmark_OE.synthetic_frame('national', 'soc2000')
+	source = make_workdir(tmp_path, df)
+	ingest(tmp_path, 'reingest.db', [], ingest_args)
+	before = rollup_rows(str(tmp_path / 'reingest.db'))
+	df[ ~df['OCC_CODE'].str.startswith('11-') ].to_excel(source, index=False)
+	run_script(tmp_path, str(tmp_path / 'reingest.db'), 'get_OE_data_from_xlsx.py', '--quiet', '--force', *ingest_args)
+	reingested = rollup_rows(str(tmp_path / 'reingest.db'))
+	ingest(tmp_path, 'fresh.db', [], ingest_args)
+	fresh = rollup_rows(str(tmp_path / 'fresh.db'))
+	assert len(fresh) < len(before)
+	assert [row[:6] + row[7:] for row in reingested] == [row[:6] + row[7:] for row in fresh]
+	assert [row[6] for row in reingested] == pytest.approx([row[6] for row in fresh], rel=1e-9, nan_ok=True)
+
+def test_failed_build_load_keeps_the_indexes(tmp_path):
+	# --build drops the secondary indexes for the load; a file that fails to parse must not leave them dropped
+	make_workdir(tmp_path, benchmark_OE.synthetic_frame('national', 'soc2000'))
+	with open(str(tmp_path / DATA_FOLDER / NAT_FOLDER / '2010.xlsx'), 'wb') as f:
+		f.write(b'not a workbook')
+	db_path = str(tmp_path / 'OE.db')
+	run_script(tmp_path, db_path, 'build_database_OE.py')
+	with pytest.raises(subprocess.CalledProcessError):
+		subprocess.run([sys.executable, os.path.join(REPO, 'get_OE_data_from_xlsx.py'), '--quiet', '--build'],
+			cwd=str(tmp_path), check=True, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+			env=dict(os.environ, OE_DB_PATH=db_path))
+	conn = sqlite3.connect(db_path)
+	indexes = {row[0] for row in conn.execute("""SELECT name FROM sqlite_master WHERE type='index' AND sql IS NOT NULL""")}
+	conn.close()
+	assert indexes >= {name for name, _, _ in build_database_OE.INDEXES}